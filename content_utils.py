@@ -1,66 +1,74 @@
 import re
 
+# Wayback wrappers (group 1) are dropped; Quibey/Hero origins become "/".
+SITE_URL_RE = re.compile(
+    r"(https://web\.archive\.org/web/\d+(?:id_)?/https://hero\.page)"
+    r"|(?:https?:)?//(?:quibey\.com|hero\.page)(?:/|(?=[\"']))"
+)
+CDN_HOST_RE = re.compile(
+    r"(https?:)?//(?:cdn-2\.hero\.com|cdn\.hero\.page)",
+    re.IGNORECASE,
+)
+# Match each <link> tag once (possessively, to the next ">" or the end of the
+# document) and test it for rel=canonical separately. A single pattern with
+# rel=canonical in the middle rescans to the end from every unterminated <link.
+LINK_TAG_RE = re.compile(r"<link[^>]*+>?", re.IGNORECASE)
+CANONICAL_REL_RE = re.compile(r"rel=[\"']canonical[\"']", re.IGNORECASE)
+HEAD_RE = re.compile(r"<head[^>]*>")
+# The React bundle (main.*.js, *.chunk.*.js) and its inline bootstrap are
+# removed together in one walk over the document's <script> tags. The inline
+# body is matched up to the first </script> with possessive runs of non-"<"
+# text, so a large script is consumed in chunks rather than char by char with
+# a backtrack point at each.
+REACT_SCRIPT_RE = re.compile(
+    r'<script[^>]*src="[^"]*(?:main|chunk)\.[^"]*\.js"[^>]*></script>'
+    r"|<script>window\.__REACT[^<]*+(?:<(?!/script>)[^<]*+)*+</script>"
+)
+POINTER_EVENTS_NONE_RE = re.compile(r"pointer-events:( ?)none")
+TITLE_RE = re.compile(r"<title>([^<]+)</title>")
+DESCRIPTION_RE = re.compile(r'<meta name="description" content="([^"]+)"')
+
+
+def _site_url_replacement(match):
+    return "" if match.group(1) else "/"
+
+
+def _cdn_host_replacement(match):
+    # Absolute URLs are pinned to https; protocol-relative ones stay relative.
+    if match.group(1):
+        return "https://cdn-2.quibey.com"
+    return "//cdn-2.quibey.com"
+
+
+def _strip_canonical_link(match):
+    tag = match.group(0)
+    if tag.endswith(">") and CANONICAL_REL_RE.search(tag):
+        return ""
+    return tag
+
 
 def fix_content(content, path, domain):
     """Fix links and references to work locally."""
     if not path.startswith("/"):
         path = "/" + path
 
-    # Remove Wayback Machine wrapper
-    content = re.sub(
-        r"https://web\.archive\.org/web/\d+id_/https://hero\.page",
-        "",
-        content,
-    )
-    content = re.sub(
-        r"https://web\.archive\.org/web/\d+/https://hero\.page",
-        "",
-        content,
-    )
-
-    # Rewrite absolute Quibey/Hero links to local paths.
-    content = re.sub(r"https?://quibey\.com/", "/", content)
-    content = re.sub(r"https?://quibey\.com(?=[\"'])", "/", content)
-    content = re.sub(r"https?://hero\.page/", "/", content)
-    content = re.sub(r"https?://hero\.page(?=[\"'])", "/", content)
-    content = re.sub(r"//hero\.page/", "/", content)
-    content = re.sub(r"//hero\.page(?=[\"'])", "/", content)
-    content = re.sub(r"//quibey\.com/", "/", content)
-    content = re.sub(r"//quibey\.com(?=[\"'])", "/", content)
+    # Each pass below is skipped outright when its literal anchor is absent;
+    # a substring check is far cheaper than a regex walk over the document.
+
+    # Remove Wayback Machine wrappers and rewrite absolute Quibey/Hero links
+    # to local paths in a single pass.
+    if (
+        "web.archive.org/web/" in content
+        or "//quibey.com" in content
+        or "//hero.page" in content
+    ):
+        content = SITE_URL_RE.sub(_site_url_replacement, content)
 
     # Fix CDN hosts for assets (avoid broken Hero/hero.page CDN references).
-    content = re.sub(
-        r"https?://cdn-2\.hero\.com",
-        "https://cdn-2.quibey.com",
-        content,
-        flags=re.IGNORECASE,
-    )
-    content = re.sub(
-        r"https?://cdn\.hero\.page",
-        "https://cdn-2.quibey.com",
-        content,
-        flags=re.IGNORECASE,
-    )
-    content = re.sub(
-        r"//cdn-2\.hero\.com",
-        "//cdn-2.quibey.com",
-        content,
-        flags=re.IGNORECASE,
-    )
-    content = re.sub(
-        r"//cdn\.hero\.page",
-        "//cdn-2.quibey.com",
-        content,
-        flags=re.IGNORECASE,
-    )
+    content = CDN_HOST_RE.sub(_cdn_host_replacement, content)
 
     # Remove existing canonical tags and add new one for hero.page.
-    content = re.sub(
-        r"<link[^>]*rel=[\"']canonical[\"'][^>]*?/?>",
-        "",
-        content,
-        flags=re.IGNORECASE,
-    )
+    content = LINK_TAG_RE.sub(_strip_canonical_link, content)
     canonical = f'<link rel="canonical" href="https://{domain}{path}" />'
 
     # Google Analytics (gtag.js)
@@ -74,37 +82,23 @@ def fix_content(content, path, domain):
   gtag('config', 'G-60QCN7FNK5');
 </script>"""
 
-    if re.search(r"<head[^>]*>", content):
-        content = re.sub(
-            r"<head[^>]*>",
-            lambda match: f"{match.group(0)}\n{ga_script}\n{canonical}",
-            content,
-            count=1,
-        )
+    head_match = HEAD_RE.search(content)
+    if head_match:
+        head_end = head_match.end()
+        content = f"{content[:head_end]}\n{ga_script}\n{canonical}{content[head_end:]}"
 
-    # Remove React JavaScript to make links work as plain HTML.
-    content = re.sub(
-        r'<script[^>]*src="[^"]*main\.[^"]*\.js"[^>]*></script>',
-        "",
-        content,
-    )
-    content = re.sub(
-        r'<script[^>]*src="[^"]*chunk\.[^"]*\.js"[^>]*></script>',
-        "",
-        content,
-    )
-
-    # Also remove inline scripts that might interfere.
-    content = re.sub(
-        r"<script>window\.__REACT.*?</script>",
-        "",
-        content,
-        flags=re.DOTALL,
-    )
+    # Remove React JavaScript, including inline bootstrap scripts that might
+    # interfere, to make links work as plain HTML.
+    if (
+        "main." in content
+        or "chunk." in content
+        or "<script>window.__REACT" in content
+    ):
+        content = REACT_SCRIPT_RE.sub("", content)
 
     # Fix pointer-events: none that blocks clicking.
-    content = content.replace("pointer-events: none", "pointer-events: auto")
-    content = content.replace("pointer-events:none", "pointer-events:auto")
+    if "pointer-events" in content:
+        content = POINTER_EVENTS_NONE_RE.sub(r"pointer-events:\1auto", content)
 
     # Add CSS override to ensure all links are clickable.
     if "</head>" in content:
@@ -114,16 +108,16 @@ a, a *, [href] { pointer-events: auto !important; cursor: pointer !important; }
         content = content.replace("</head>", f"{css_fix}</head>")
 
     # If page is an SPA shell (empty root div), add a fallback message with metadata.
-    if (
-        '<div class="main-window" id="root"></div>' in content
-        or '<div id="root"></div>' in content
-    ):
+    # Only one root div is expected, so find which form it takes and fill that one.
+    root_div = None
+    if '<div class="main-window" id="root"></div>' in content:
+        root_div = '<div class="main-window" id="root"></div>'
+    elif '<div id="root"></div>' in content:
+        root_div = '<div id="root"></div>'
+    if root_div:
         # Extract title and description from meta tags.
-        title_match = re.search(r"<title>([^<]+)</title>", content)
-        desc_match = re.search(
-            r'<meta name="description" content="([^"]+)"',
-            content,
-        )
+        title_match = TITLE_RE.search(content)
+        desc_match = DESCRIPTION_RE.search(content)
 
         title = title_match.group(1) if title_match else "Hero Page"
         description = desc_match.group(1) if desc_match else ""
@@ -137,12 +131,21 @@ a, a *, [href] { pointer-events: auto !important; cursor: pointer !important; }
 </div>
 """
         content = content.replace(
-            '<div class="main-window" id="root"></div>',
-            f'<div class="main-window" id="root">{fallback_content}</div>',
-        )
-        content = content.replace(
-            '<div id="root"></div>',
-            f'<div id="root">{fallback_content}</div>',
+            root_div,
+            root_div.replace("></div>", f">{fallback_content}</div>"),
+            1,
         )
 
     return content
+
+
+def fix_content_bytes(content, path, domain):
+    """Fix a raw UTF-8 document without decoding it.
+
+    Every pattern and injected snippet is ASCII, so the bytes are mapped
+    one-to-one through latin-1 and back instead of a full UTF-8 decode and
+    re-encode. The path is UTF-8 encoded once up front to match.
+    """
+    path = path.encode("utf-8").decode("latin-1")
+    domain = domain.encode("utf-8").decode("latin-1")
+    return fix_content(content.decode("latin-1"), path, domain).encode("latin-1")
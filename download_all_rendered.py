@@ -3,51 +3,232 @@
 Download rendered versions of ALL pages linked from the site
 """
 import os
+import email.utils
+import gzip
 import re
 import time
+import urllib.error
+import urllib.parse
 import urllib.request
 import ssl
+import threading
 from pathlib import Path
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# orjson parses large CDX listings several times faster; json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 OUTPUT_DIR = Path("hero_page_site")
-WAYBACK_RAW_URL = "https://web.archive.org/web/20250519id_/https://hero.page{path}"
+WAYBACK_TIMESTAMP = "20250519"
+WAYBACK_RAW_URL = "https://web.archive.org/web/{timestamp}id_/https://hero.page{path}"
+WAYBACK_CDX_API = "https://web.archive.org/cdx/search/cdx"
+# All workers draw from one limiter, so MAX_RATE caps the total request rate
+# however many workers are running
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+MAX_RATE = float(os.environ.get("MAX_RATE", "4"))  # requests per second
+MAX_RETRIES = 3
+# Pages are handled as raw bytes, so both patterns are bytes patterns.
+# Wayback-wrapped and direct hero.page URLs; dropping the origin leaves a local path
+HERO_URL_RE = re.compile(rb"https://(?:web\.archive\.org/web/\d+(?:id_)?/https://)?hero\.page")
+# Root-relative href values. Group 1 captures the path (query and fragment
+# dropped) only if it isn't protocol-relative and mentions no asset extension;
+# other values still match, with an empty group, so they are consumed whole.
+LINK_RE = re.compile(
+    rb'href="(?:(/(?!/)(?:(?!\.(?:js|css|png|jpg|ico|json|xml|txt))[^"?#])*)(?:[?#][^"]*)?|/[^"]*)"'
+)
 
 downloaded = set()
 failed = set()
+in_flight = set()
 queue = deque()
+# Exact snapshot per path from one CDX query, so fetches skip Wayback's
+# nearest-snapshot redirect; unlisted paths fall back to WAYBACK_TIMESTAMP
+timestamps = {}
+# Guards downloaded/failed, which worker threads update
+state_lock = threading.Lock()
+
+# Shared by every worker; SSLContext is safe to reuse across threads
+SSL_CONTEXT = ssl.create_default_context()
+
+# Monotonic time until which every worker holds off, set from a 429's Retry-After
+rate_limited_until = 0.0
+rate_limit_lock = threading.Lock()
+
+class RateLimiter:
+    """Token bucket shared by every worker, paced with AIMD.
+
+    Requests are spaced 1/rate seconds apart. A 429 halves the rate (down
+    to min_rate); about a second's worth of successes adds one request per
+    second back, up to max_rate.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+        self.max_rate = self.rate = float(max_rate)
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Back off after a 429"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.successes = 0
+
+    def success(self):
+        """Creep back toward max_rate after a successful response"""
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+limiter = RateLimiter(MAX_RATE)
 
-def get_ssl_context():
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    return ctx
+def retry_after_seconds(headers, default):
+    """Seconds to wait per a Retry-After header (delta-seconds or HTTP-date)"""
+    value = (headers.get("Retry-After") or "").strip() if headers else ""
+    if value.isdigit():
+        return int(value)
+    if value:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+def pause_all_workers(seconds):
+    """Make every worker wait the given time before its next request"""
+    global rate_limited_until
+    with rate_limit_lock:
+        rate_limited_until = max(rate_limited_until, time.monotonic() + seconds)
+
+def wait_for_rate_limit():
+    """Sleep out any pause set by pause_all_workers"""
+    while True:
+        with rate_limit_lock:
+            remaining = rate_limited_until - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+def snapshot_key(path):
+    """Key for timestamps; a trailing slash doesn't change the page"""
+    return path.rstrip("/") or "/"
+
+def iter_cdx_rows(stream):
+    """Parse a CDX ``output=json`` body one row per line"""
+    header_seen = False
+    for raw_line in stream:
+        line = raw_line.strip().rstrip(b",")
+        # The outer array brackets sit on the first and last rows.
+        if line.startswith(b"[["):
+            line = line[1:]
+        if line.endswith(b"]]"):
+            line = line[:-1]
+        if line in (b"", b"[", b"]", b"[]"):
+            continue
+        if not header_seen:
+            header_seen = True
+            continue
+        yield json_loads(line)
+
+def resolve_timestamps():
+    """Map each archived path to its latest 200 snapshot at or before WAYBACK_TIMESTAMP"""
+    # No lower bound, so snapshots from earlier years count too. Collapsing
+    # on the day keeps one capture per path per day (collapse=urlkey would
+    # keep only the oldest), and rows are parsed as they stream in.
+    params = urllib.parse.urlencode({
+        "url": "hero.page/*",
+        "output": "json",
+        "fl": "original,timestamp",
+        "filter": "statuscode:200",
+        "collapse": "timestamp:8",
+        "to": WAYBACK_TIMESTAMP,
+    })
+    req = urllib.request.Request(f"{WAYBACK_CDX_API}?{params}", headers={
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+        "Accept-Encoding": "gzip",
+    })
+    resolved = {}
+    try:
+        with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=120) as response:
+            stream = response
+            if response.headers.get("Content-Encoding") == "gzip":
+                stream = gzip.GzipFile(fileobj=response)
+            for original, timestamp in iter_cdx_rows(stream):
+                key = snapshot_key(urllib.parse.urlsplit(original).path)
+                if timestamp > resolved.get(key, ""):
+                    resolved[key] = timestamp
+    except Exception as e:
+        print(f"CDX lookup failed, using {WAYBACK_TIMESTAMP} for every page: {e}")
+        return
+
+    timestamps.update(resolved)
+    print(f"Resolved snapshots for {len(timestamps)} paths")
 
 def extract_links(content):
     """Extract all internal links from HTML content"""
-    links = set()
-    # Find href="/..." links
-    for match in re.findall(r'href="(/[^"]*)"', content):
-        # Clean up the path
-        path = match.split('?')[0].split('#')[0]
-        if path and not path.startswith('//') and not any(x in path for x in ['.js', '.css', '.png', '.jpg', '.ico', '.json', '.xml', '.txt']):
-            links.add(path)
-    return links
+    return {
+        link.decode('utf-8', errors='ignore')
+        for link in set(LINK_RE.findall(content))
+        if link
+    }
 
 def fix_links(content):
     """Fix links to work locally"""
-    content = re.sub(r'https://web\.archive\.org/web/\d+id_/https://hero\.page', '', content)
-    content = re.sub(r'https://web\.archive\.org/web/\d+/https://hero\.page', '', content)
-    content = re.sub(r'https://hero\.page/', '/', content)
-    content = re.sub(r'https://hero\.page', '', content)
-    return content
+    return HERO_URL_RE.sub(b'', content)
+
+def fetch_page(url):
+    """GET url through the shared limiter, retrying 429s after their Retry-After"""
+    for attempt in range(MAX_RETRIES):
+        wait_for_rate_limit()
+        limiter.acquire()
+        req = urllib.request.Request(url, headers={
+            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
+        })
+        try:
+            with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=30) as response:
+                content = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 429:  # Too Many Requests
+                raise
+            limiter.throttle()
+            if attempt == MAX_RETRIES - 1:
+                raise
+            wait_time = retry_after_seconds(e.headers, 30 * (attempt + 1))
+            print(f"Rate limited, all workers waiting {wait_time:.0f}s...")
+            pause_all_workers(wait_time)
+            continue
+        limiter.success()
+        return content
 
 def download_page(path):
     """Download a rendered page from Wayback Machine"""
-    if path in downloaded or path in failed:
-        return None
+    with state_lock:
+        if path in downloaded or path in failed:
+            return None
 
-    url = WAYBACK_RAW_URL.format(path=path)
+    timestamp = timestamps.get(snapshot_key(path), WAYBACK_TIMESTAMP)
+    url = WAYBACK_RAW_URL.format(timestamp=timestamp, path=path)
 
     # Determine local file path
     if path == "/" or path == "":
@@ -59,36 +240,35 @@ def download_page(path):
         else:
             return None
 
-    ctx = get_ssl_context()
-
     try:
-        req = urllib.request.Request(url, headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-        })
-        with urllib.request.urlopen(req, context=ctx, timeout=30) as response:
-            content = response.read().decode('utf-8', errors='ignore')
+        # Only URL prefixes are rewritten, so the body stays undecoded
+        content = fetch_page(url)
 
-            # Only save if it has actual content (not just SPA shell)
-            if len(content) > 5000:
-                # Fix links
-                content = fix_links(content)
+        # Only save if it has actual content (not just SPA shell)
+        if len(content) > 5000:
+            # Fix links
+            content = fix_links(content)
 
-                # Create directory if needed
-                local_path.parent.mkdir(parents=True, exist_ok=True)
+            # Create directory if needed
+            local_path.parent.mkdir(parents=True, exist_ok=True)
 
-                with open(local_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+            with open(local_path, 'wb') as f:
+                f.write(content)
 
+            with state_lock:
                 downloaded.add(path)
-                print(f"[{len(downloaded)}] OK: {path[:60]} ({len(content)} bytes)")
+                count = len(downloaded)
+            print(f"[{count}] OK: {path[:60]} ({len(content)} bytes)")
 
-                # Extract new links to crawl
-                return extract_links(content)
-            else:
+            # Extract new links to crawl
+            return extract_links(content)
+        else:
+            with state_lock:
                 failed.add(path)
-                return None
+            return None
     except Exception as e:
-        failed.add(path)
+        with state_lock:
+            failed.add(path)
         return None
 
 def main():
@@ -111,20 +291,38 @@ def main():
 
     max_pages = 500  # Limit to avoid too long download
 
-    while queue and len(downloaded) < max_pages:
-        path = queue.popleft()
-
-        if path in downloaded or path in failed:
-            continue
+    resolve_timestamps()
+    print(f"Using {MAX_WORKERS} parallel workers at up to {MAX_RATE} requests/s")
 
-        new_links = download_page(path)
+    # The queue and in_flight are only touched here; workers report new
+    # links back through their futures.
+    pending = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while queue or pending:
+            while queue and len(pending) < MAX_WORKERS:
+                with state_lock:
+                    if len(downloaded) + len(in_flight) >= max_pages:
+                        break
+                    path = queue.popleft()
+                    if path in downloaded or path in failed or path in in_flight:
+                        continue
+                    in_flight.add(path)
+                pending[executor.submit(download_page, path)] = path
 
-        if new_links:
-            for link in new_links:
-                if link not in downloaded and link not in failed and link not in queue:
-                    queue.append(link)
+            if not pending:
+                break
 
-        time.sleep(0.5)  # Rate limiting
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                new_links = future.result()
+                with state_lock:
+                    in_flight.discard(path)
+                    if new_links:
+                        for link in new_links:
+                            if (link not in downloaded and link not in failed
+                                    and link not in in_flight and link not in queue):
+                                queue.append(link)
 
     print("-" * 60)
     print(f"Downloaded: {len(downloaded)}, Failed: {len(failed)}")
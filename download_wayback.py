@@ -3,46 +3,198 @@
 Download hero.page from Wayback Machine with proper rate limiting
 """
 import os
-import json
+import gzip
+import http.client
 import time
+import urllib.error
 import urllib.request
 import urllib.parse
 import ssl
+import threading
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# orjson parses large CDX listings several times faster; json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 BASE_URL = "https://hero.page"
 OUTPUT_DIR = Path("hero_page_site")
 WAYBACK_CDX_API = "https://web.archive.org/cdx/search/cdx"
 WAYBACK_RAW_URL = "https://web.archive.org/web/{timestamp}id_/{url}"
 
-# Rate limiting
-REQUEST_DELAY = 0.5  # seconds between requests
+# Rate limiting: all workers draw from one limiter, so MAX_RATE caps the
+# total request rate however many workers are running
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+MAX_RATE = float(os.environ.get("MAX_RATE", "8"))  # requests per second
+# Optional earliest snapshot date (YYYYMMDD) to trim the CDX listing
+CDX_FROM = os.environ.get("CDX_FROM", "")
 MAX_RETRIES = 3
+MAX_REDIRECTS = 5
+SMALL_BODY_BYTES = 1024 * 1024  # Read whole when Content-Length is at most this
+TIMEOUT = 60
+
+# Shared by every worker; SSLContext is safe to reuse across threads
+SSL_CONTEXT = ssl.create_default_context()
+
+# Keep-alive connections, one set per worker thread
+connections = threading.local()
+
+class RateLimiter:
+    """Token bucket shared by every worker, paced with AIMD.
+
+    Requests are spaced 1/rate seconds apart. A 429 halves the rate (down
+    to min_rate); about a second's worth of successes adds one request per
+    second back, up to max_rate.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+        self.max_rate = self.rate = float(max_rate)
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Back off after a 429"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.successes = 0
+
+    def success(self):
+        """Creep back toward max_rate after a successful response"""
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+limiter = RateLimiter(MAX_RATE)
+
+# CDX content digest -> first local file downloaded with that content, so
+# identical captures under other URLs are hardlinked instead of fetched
+downloaded_digests = {}
+digests_lock = threading.Lock()
+
+def get_connection(host):
+    """Return this thread's persistent HTTPS connection to host"""
+    pool = getattr(connections, "pool", None)
+    if pool is None:
+        pool = connections.pool = {}
+    conn = pool.get(host)
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=TIMEOUT, context=SSL_CONTEXT)
+        pool[host] = conn
+    return conn
+
+def copy_body(body, f):
+    """Write a response body to f through one reused 64KB buffer.
+
+    readinto() fills the same buffer every time, so no bytes object is
+    allocated per chunk the way read()-based copyfileobj does.
+    """
+    buf = bytearray(65536)
+    view = memoryview(buf)
+    while True:
+        n = body.readinto(view)
+        if not n:
+            break
+        f.write(view[:n])
+
+def fetch_to_file(url, headers, local_path):
+    """GET url over a reused connection into local_path, returning its size.
+
+    The body is streamed in 64KB chunks to a .part file that is renamed into
+    place once complete, so an interrupted download never looks finished.
+    """
+    partial = local_path.with_name(local_path.name + ".part")
+    for _ in range(MAX_REDIRECTS):
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        conn = get_connection(parsed.netloc)
+        limiter.acquire()
+        try:
+            conn.request("GET", target, headers=headers)
+            response = conn.getresponse()
+            if response.status == 429:
+                limiter.throttle()
+            elif response.status < 400:
+                limiter.success()
+            if response.status >= 300:
+                response.read()
+            else:
+                # Sent gzipped when we ask for it; stored decoded
+                with open(partial, 'wb') as f:
+                    if response.getheader("Content-Encoding") == "gzip":
+                        copy_body(gzip.GzipFile(fileobj=response), f)
+                    elif response.length is not None and response.length <= SMALL_BODY_BYTES:
+                        # Known and small: one read and one write beat a loop
+                        f.write(response.read())
+                    else:
+                        copy_body(response, f)
+                    size = f.tell()
+        except (http.client.HTTPException, OSError, EOFError):
+            # Drop the broken socket; the next request reconnects.
+            conn.close()
+            partial.unlink(missing_ok=True)
+            raise
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            continue
+        if response.status >= 300:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        os.replace(partial, local_path)
+        return size
+    raise urllib.error.URLError(f"too many redirects for {url}")
 
 def get_all_snapshots():
     """Get all unique URLs from Wayback Machine CDX API"""
     print("Fetching URL list from Wayback Machine CDX API...")
 
+    # Only the columns we read, and revisit records (which replay as empty
+    # bodies) are dropped by the server rather than fetched and discarded
     params = {
         "url": "hero.page/*",
         "output": "json",
+        "fl": "original,timestamp,digest,mimetype,length",
         "collapse": "urlkey",
-        "filter": "statuscode:200",
         "limit": "10000"
     }
+    if CDX_FROM:
+        params["from"] = CDX_FROM
 
-    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode(params)}"
-
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+    filters = [("filter", "statuscode:200"), ("filter", "!mimetype:warc/revisit")]
+    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode([*params.items(), *filters])}"
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-            with urllib.request.urlopen(req, context=ctx, timeout=60) as response:
-                data = json.loads(response.read().decode())
+            req = urllib.request.Request(url, headers={
+                "User-Agent": "Mozilla/5.0",
+                "Accept-Encoding": "gzip",
+            })
+            with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=60) as response:
+                body = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                data = json_loads(body)
                 # Skip header row
                 return data[1:] if len(data) > 1 else []
         except Exception as e:
@@ -51,43 +203,20 @@ def get_all_snapshots():
 
     return []
 
-def get_latest_snapshot_for_url(url):
-    """Get the most recent snapshot timestamp for a specific URL"""
-    params = {
-        "url": url,
-        "output": "json",
-        "limit": "1",
-        "filter": "statuscode:200"
-    }
-
-    api_url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode(params)}"
-
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    try:
-        req = urllib.request.Request(api_url, headers={"User-Agent": "Mozilla/5.0"})
-        with urllib.request.urlopen(req, context=ctx, timeout=30) as response:
-            data = json.loads(response.read().decode())
-            if len(data) > 1:
-                return data[1][1]  # timestamp
-    except:
-        pass
-    return None
-
-def download_file(url, timestamp, output_dir):
-    """Download a file from Wayback Machine"""
-    # Create the wayback URL for raw content
-    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
-
-    # Determine local file path
+def url_to_path(url):
+    """Local path, relative to the output directory, for an archived URL"""
     parsed = urllib.parse.urlparse(url)
     path = parsed.path.strip("/")
     if not path:
         path = "index.html"
     elif not os.path.splitext(path)[1]:
         path = path.rstrip("/") + "/index.html"
+    return path
+
+def download_file(url, timestamp, digest, path, output_dir):
+    """Download a file from Wayback Machine, or link it to an identical one"""
+    # Create the wayback URL for raw content
+    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
 
     local_path = output_dir / path
 
@@ -95,23 +224,25 @@ def download_file(url, timestamp, output_dir):
     if local_path.exists():
         return f"Skipped (exists): {path}"
 
-    # Create directory
-    local_path.parent.mkdir(parents=True, exist_ok=True)
-
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+    with digests_lock:
+        existing = downloaded_digests.get(digest)
+    if existing is not None:
+        try:
+            os.link(existing, local_path)
+            return f"Linked: {path} (same content as {existing.relative_to(output_dir)})"
+        except OSError:
+            pass  # Fall back to downloading it
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(wayback_url, headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-            })
-            with urllib.request.urlopen(req, context=ctx, timeout=60) as response:
-                content = response.read()
-                with open(local_path, 'wb') as f:
-                    f.write(content)
-                return f"Downloaded: {path} ({len(content)} bytes)"
+            size = fetch_to_file(wayback_url, {
+                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+                "Accept-Encoding": "gzip",
+            }, local_path)
+            if digest:
+                with digests_lock:
+                    downloaded_digests.setdefault(digest, local_path)
+            return f"Downloaded: {path} ({size} bytes)"
         except Exception as e:
             if attempt < MAX_RETRIES - 1:
                 time.sleep(2 ** attempt)
@@ -120,6 +251,14 @@ def download_file(url, timestamp, output_dir):
 
     return f"Failed: {path}"
 
+def create_directories(output_dir, paths):
+    """Create each distinct parent directory of paths once, before any download"""
+    for directory in {os.path.dirname(path) for path in paths}:
+        try:
+            (output_dir / directory).mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass  # e.g. a file already holds the name; those downloads fail and are reported
+
 def main():
     print("=" * 60)
     print("Wayback Machine Downloader for hero.page")
@@ -136,38 +275,53 @@ def main():
     # Create output directory
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Process URLs - using most recent timestamp for each
-    urls_to_download = []
+    # Process URLs - using most recent timestamp for each, all from the one
+    # CDX listing rather than a lookup per URL
+    latest = {}
     for row in snapshots:
-        # row format: [urlkey, timestamp, original, mimetype, statuscode, digest, length]
-        url = row[2]
-        timestamp = row[1]
-        urls_to_download.append((url, timestamp))
+        # row format: [original, timestamp, digest, mimetype, length]
+        url, timestamp, digest = row[:3]
+        if url not in latest or timestamp > latest[url][0]:
+            latest[url] = (timestamp, digest)
+    # Local paths are derived once here rather than in each worker, and
+    # files in the same directory are queued together
+    urls_to_download = [
+        (url, timestamp, digest, url_to_path(url))
+        for url, (timestamp, digest) in latest.items()
+    ]
+    urls_to_download.sort(key=lambda task: os.path.dirname(task[3]))
+
+    create_directories(OUTPUT_DIR, (path for _, _, _, path in urls_to_download))
 
     print(f"\nDownloading {len(urls_to_download)} files...")
     print("-" * 60)
 
     downloaded = 0
+    linked = 0
     failed = 0
     skipped = 0
 
-    for i, (url, timestamp) in enumerate(urls_to_download):
-        result = download_file(url, timestamp, OUTPUT_DIR)
-
-        if "Downloaded" in result:
-            downloaded += 1
-            print(f"[{i+1}/{len(urls_to_download)}] {result}")
-        elif "Skipped" in result:
-            skipped += 1
-        else:
-            failed += 1
-            print(f"[{i+1}/{len(urls_to_download)}] {result}")
-
-        # Rate limiting
-        time.sleep(REQUEST_DELAY)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(download_file, url, timestamp, digest, path, OUTPUT_DIR)
+            for url, timestamp, digest, path in urls_to_download
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            result = future.result()
+
+            if "Downloaded" in result:
+                downloaded += 1
+                print(f"[{i+1}/{len(urls_to_download)}] {result}")
+            elif "Linked" in result:
+                linked += 1
+            elif "Skipped" in result:
+                skipped += 1
+            else:
+                failed += 1
+                print(f"[{i+1}/{len(urls_to_download)}] {result}")
 
     print("-" * 60)
-    print(f"Done! Downloaded: {downloaded}, Skipped: {skipped}, Failed: {failed}")
+    print(f"Done! Downloaded: {downloaded}, Linked: {linked}, Skipped: {skipped}, Failed: {failed}")
     print(f"Files saved to: {OUTPUT_DIR.absolute()}")
 
 if __name__ == "__main__":
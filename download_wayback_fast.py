@@ -3,8 +3,11 @@
 Fast parallel download of hero.page from Wayback Machine
 """
 import os
-import json
+import email.utils
+import gzip
+import http.client
 import time
+import urllib.error
 import urllib.request
 import urllib.parse
 import ssl
@@ -13,65 +16,211 @@ from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from queue import Queue
 
+# orjson parses large CDX listings several times faster; json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 BASE_URL = "https://hero.page"
 OUTPUT_DIR = Path("hero_page_site")
 WAYBACK_CDX_API = "https://web.archive.org/cdx/search/cdx"
 WAYBACK_RAW_URL = "https://web.archive.org/web/{timestamp}id_/{url}"
 
-# Parallel settings
-MAX_WORKERS = 10  # Concurrent downloads
+# Parallel settings. All workers draw from one limiter, so MAX_RATE caps the
+# total request rate however many workers are running
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))  # Concurrent downloads
+MAX_RATE = float(os.environ.get("MAX_RATE", "8"))  # requests per second
 MAX_RETRIES = 3
+MAX_REDIRECTS = 5
 TIMEOUT = 30
-
-# Progress tracking
-lock = threading.Lock()
-downloaded_count = 0
-failed_count = 0
-skipped_count = 0
-
-def get_ssl_context():
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    return ctx
+# Characters that are unsafe in local file names, all mapped to "_"
+UNSAFE_PATH_CHARS = str.maketrans(dict.fromkeys("%:?", "_"))
+
+# Shared by every worker; SSLContext is safe to reuse across threads
+SSL_CONTEXT = ssl.create_default_context()
+
+# Keep-alive connections, one set per worker thread
+connections = threading.local()
+
+# Monotonic time until which every worker holds off, set from a 429's Retry-After
+rate_limited_until = 0.0
+rate_limit_lock = threading.Lock()
+
+class RateLimiter:
+    """Token bucket shared by every worker, paced with AIMD.
+
+    Requests are spaced 1/rate seconds apart. A 429 halves the rate (down
+    to min_rate); about a second's worth of successes adds one request per
+    second back, up to max_rate.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+        self.max_rate = self.rate = float(max_rate)
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Back off after a 429"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.successes = 0
+
+    def success(self):
+        """Creep back toward max_rate after a successful response"""
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+limiter = RateLimiter(MAX_RATE)
+
+def retry_after_seconds(headers, default):
+    """Seconds to wait per a Retry-After header (delta-seconds or HTTP-date)"""
+    value = (headers.get("Retry-After") or "").strip() if headers else ""
+    if value.isdigit():
+        return int(value)
+    if value:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+def pause_all_workers(seconds):
+    """Make every worker wait the given time before its next request"""
+    global rate_limited_until
+    with rate_limit_lock:
+        rate_limited_until = max(rate_limited_until, time.monotonic() + seconds)
+
+def wait_for_rate_limit():
+    """Sleep out any pause set by pause_all_workers"""
+    while True:
+        with rate_limit_lock:
+            remaining = rate_limited_until - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+
+def get_connection(host):
+    """Return this thread's persistent HTTPS connection to host"""
+    pool = getattr(connections, "pool", None)
+    if pool is None:
+        pool = connections.pool = {}
+    conn = pool.get(host)
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=TIMEOUT, context=SSL_CONTEXT)
+        pool[host] = conn
+    return conn
+
+def fetch_bytes(url, headers):
+    """GET url over a reused connection, following redirects"""
+    for _ in range(MAX_REDIRECTS):
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        conn = get_connection(parsed.netloc)
+        wait_for_rate_limit()
+        limiter.acquire()
+        try:
+            conn.request("GET", target, headers=headers)
+            response = conn.getresponse()
+            if response.status == 429:
+                limiter.throttle()
+            elif response.status < 400:
+                limiter.success()
+            content = response.read()
+            # Sent gzipped when we ask for it; returned decoded
+            if response.getheader("Content-Encoding") == "gzip":
+                content = gzip.decompress(content)
+        except (http.client.HTTPException, OSError, EOFError):
+            # Drop the broken socket; the next request reconnects.
+            conn.close()
+            raise
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            continue
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return content
+    raise urllib.error.URLError(f"too many redirects for {url}")
+
+def iter_cdx_rows(stream):
+    """Parse a CDX ``output=json`` body one row per line"""
+    header_seen = False
+    for raw_line in stream:
+        line = raw_line.strip().rstrip(b",")
+        # The outer array brackets sit on the first and last rows.
+        if line.startswith(b"[["):
+            line = line[1:]
+        if line.endswith(b"]]"):
+            line = line[:-1]
+        if line in (b"", b"[", b"]", b"[]"):
+            continue
+        if not header_seen:
+            header_seen = True
+            continue
+        yield json_loads(line)
 
 def get_all_snapshots():
-    """Get all unique URLs from Wayback Machine CDX API"""
+    """Yield all unique URLs from Wayback Machine CDX API"""
     print("Fetching URL list from Wayback Machine CDX API...")
 
+    # Only the columns we read, and revisit records (which replay as empty
+    # bodies) are dropped by the server rather than fetched and discarded
     params = {
         "url": "hero.page/*",
         "output": "json",
+        "fl": "original,timestamp,digest,mimetype,length",
         "collapse": "urlkey",
-        "filter": "statuscode:200",
         "limit": "10000"
     }
 
-    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode(params)}"
-    ctx = get_ssl_context()
+    filters = [("filter", "statuscode:200"), ("filter", "!mimetype:warc/revisit")]
+    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode([*params.items(), *filters])}"
+    yielded = 0
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-            with urllib.request.urlopen(req, context=ctx, timeout=60) as response:
-                data = json.loads(response.read().decode())
-                return data[1:] if len(data) > 1 else []
+            req = urllib.request.Request(url, headers={
+                "User-Agent": "Mozilla/5.0",
+                "Accept-Encoding": "gzip",
+            })
+            with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=60) as response:
+                stream = response
+                if response.headers.get("Content-Encoding") == "gzip":
+                    stream = gzip.GzipFile(fileobj=response)
+                # Rows already handed out before a retry are skipped, not repeated.
+                for idx, row in enumerate(iter_cdx_rows(stream)):
+                    if idx >= yielded:
+                        yielded += 1
+                        yield row
+                return
         except Exception as e:
             print(f"Attempt {attempt + 1} failed: {e}")
             time.sleep(2 ** attempt)
 
-    return []
-
-def download_file(args):
-    """Download a file from Wayback Machine"""
-    global downloaded_count, failed_count, skipped_count
-
-    url, timestamp, idx, total = args
-
-    # Create the wayback URL for raw content
-    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
-
-    # Determine local file path
+def url_to_path(url):
+    """Local path, relative to OUTPUT_DIR, for an archived URL"""
     parsed = urllib.parse.urlparse(url)
     path = parsed.path.strip("/")
 
@@ -85,53 +234,58 @@ def download_file(args):
         path = path.rstrip("/") + "/index.html"
 
     # Clean up path
-    path = path.replace("%", "_").replace(":", "_").replace("?", "_")
+    return path.translate(UNSAFE_PATH_CHARS)
+
+def download_file(args):
+    """Download a file from Wayback Machine, returning (status, message)"""
+    url, timestamp, path, idx, total = args
+
+    # Create the wayback URL for raw content
+    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
 
     local_path = OUTPUT_DIR / path
 
     # Skip if already downloaded
     if local_path.exists() and local_path.stat().st_size > 0:
-        with lock:
-            skipped_count += 1
-        return None
-
-    # Create directory
-    local_path.parent.mkdir(parents=True, exist_ok=True)
-
-    ctx = get_ssl_context()
+        return "skipped", None
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(wayback_url, headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
+            content = fetch_bytes(wayback_url, {
+                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+                "Accept-Encoding": "gzip",
             })
-            with urllib.request.urlopen(req, context=ctx, timeout=TIMEOUT) as response:
-                content = response.read()
-                with open(local_path, 'wb') as f:
-                    f.write(content)
-                with lock:
-                    downloaded_count += 1
-                return f"[{idx}/{total}] Downloaded: {path[:60]} ({len(content)} bytes)"
+            with open(local_path, 'wb') as f:
+                f.write(content)
+            return "downloaded", f"[{idx}/{total}] Downloaded: {path[:60]} ({len(content)} bytes)"
         except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(1)
+            if attempt == MAX_RETRIES - 1:
+                return "failed", f"[{idx}/{total}] Failed: {path[:60]} - {str(e)[:30]}"
+            if isinstance(e, urllib.error.HTTPError) and e.code == 429:  # Too Many Requests
+                wait_time = retry_after_seconds(e.headers, 30 * (attempt + 1))
+                print(f"Rate limited, all workers waiting {wait_time:.0f}s...")
+                pause_all_workers(wait_time)
             else:
-                with lock:
-                    failed_count += 1
-                return f"[{idx}/{total}] Failed: {path[:60]} - {str(e)[:30]}"
+                time.sleep(1)
 
-    return None
+    return "failed", None
 
-def main():
-    global downloaded_count, failed_count, skipped_count
+def create_directories(output_dir, paths):
+    """Create each distinct parent directory of paths once, before any download"""
+    for directory in {os.path.dirname(path) for path in paths}:
+        try:
+            (output_dir / directory).mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass  # e.g. a file already holds the name; those downloads fail and are reported
 
+def main():
     print("=" * 60)
     print("Fast Wayback Machine Downloader for hero.page")
-    print(f"Using {MAX_WORKERS} parallel workers")
+    print(f"Using {MAX_WORKERS} parallel workers at up to {MAX_RATE} requests/s")
     print("=" * 60)
 
-    # Get all snapshots
-    snapshots = get_all_snapshots()
+    # Stream snapshots straight into (url, timestamp) pairs
+    snapshots = [(row[0], row[1]) for row in get_all_snapshots()]
     print(f"Found {len(snapshots)} unique URLs")
 
     if not snapshots:
@@ -141,29 +295,34 @@ def main():
     # Create output directory
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Prepare download tasks
-    tasks = []
-    for idx, row in enumerate(snapshots, 1):
-        url = row[2]
-        timestamp = row[1]
-        tasks.append((url, timestamp, idx, len(snapshots)))
+    # Prepare download tasks, deriving each local path once here. Files in
+    # the same directory are queued together, so the workers' writes stay
+    # in a few directories at a time.
+    entries = [(url, timestamp, url_to_path(url)) for url, timestamp in snapshots]
+    entries.sort(key=lambda entry: os.path.dirname(entry[2]))
+    tasks = [(*entry, idx, len(entries)) for idx, entry in enumerate(entries, 1)]
+
+    create_directories(OUTPUT_DIR, (task[2] for task in tasks))
 
     print(f"\nDownloading {len(tasks)} files with {MAX_WORKERS} workers...")
     print("-" * 60)
 
     start_time = time.time()
+    # Only the main thread touches these, so no lock is needed
+    stats = {"downloaded": 0, "failed": 0, "skipped": 0}
 
     # Use ThreadPoolExecutor for parallel downloads
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         futures = {executor.submit(download_file, task): task for task in tasks}
 
         for future in as_completed(futures):
-            result = future.result()
-            if result:
-                print(result)
+            status, message = future.result()
+            stats[status] += 1
+            if message:
+                print(message)
 
             # Progress update every 100 files
-            total_processed = downloaded_count + failed_count + skipped_count
+            total_processed = stats["downloaded"] + stats["failed"] + stats["skipped"]
             if total_processed % 100 == 0 and total_processed > 0:
                 elapsed = time.time() - start_time
                 rate = total_processed / elapsed
@@ -175,7 +334,7 @@ def main():
     elapsed = time.time() - start_time
     print("-" * 60)
     print(f"Done in {elapsed:.1f} seconds!")
-    print(f"Downloaded: {downloaded_count} | Skipped: {skipped_count} | Failed: {failed_count}")
+    print(f"Downloaded: {stats['downloaded']} | Skipped: {stats['skipped']} | Failed: {stats['failed']}")
     print(f"Files saved to: {OUTPUT_DIR.absolute()}")
 
 if __name__ == "__main__":
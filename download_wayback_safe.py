@@ -3,56 +3,238 @@
 Safe/slow download of hero.page from Wayback Machine with proper rate limiting
 """
 import os
-import json
+import email.utils
+import gzip
+import http.client
 import time
+import urllib.error
 import urllib.request
 import urllib.parse
+import sqlite3
 import ssl
 import threading
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# orjson parses large CDX listings several times faster; json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 BASE_URL = "https://hero.page"
 OUTPUT_DIR = Path("hero_page_site")
 WAYBACK_CDX_API = "https://web.archive.org/cdx/search/cdx"
 WAYBACK_RAW_URL = "https://web.archive.org/web/{timestamp}id_/{url}"
+# One row per finished download, so a resume needn't walk OUTPUT_DIR
+MANIFEST_DB = OUTPUT_DIR / ".manifest.sqlite3"
 
 # Conservative settings to avoid rate limiting
 MAX_WORKERS = 3
 MAX_RETRIES = 3
 TIMEOUT = 45
-REQUEST_DELAY = 0.3  # Delay between requests per worker
+MAX_RATE = 4  # Requests per second across all workers
+MAX_REDIRECTS = 5
+SMALL_BODY_BYTES = 1024 * 1024  # Read whole when Content-Length is at most this
+# Characters that are unsafe in local file names, all mapped to "_"
+UNSAFE_PATH_CHARS = str.maketrans(dict.fromkeys('%:?*"<>|\\', "_"))
+
+# Shared by every worker; SSLContext is safe to reuse across threads
+SSL_CONTEXT = ssl.create_default_context()
+
+# Keep-alive connections, one set per worker thread
+connections = threading.local()
 
 # Progress tracking
 lock = threading.Lock()
 stats = {"downloaded": 0, "failed": 0, "skipped": 0}
 
-def get_ssl_context():
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    return ctx
+# Open MANIFEST_DB connection, written under lock; None if it couldn't be opened
+manifest_db = None
+
+# Monotonic time until which every worker holds off, set from a 429's Retry-After
+rate_limited_until = 0.0
+
+class RateLimiter:
+    """Token bucket shared by every worker, paced with AIMD.
+
+    Requests are spaced 1/rate seconds apart. A 429 halves the rate (down
+    to min_rate); about a second's worth of successes adds one request per
+    second back, up to max_rate.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+        self.max_rate = self.rate = float(max_rate)
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Back off after a 429"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.successes = 0
+
+    def success(self):
+        """Creep back toward max_rate after a successful response"""
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+limiter = RateLimiter(MAX_RATE)
+
+def get_connection(host):
+    """Return this thread's persistent HTTPS connection to host"""
+    pool = getattr(connections, "pool", None)
+    if pool is None:
+        pool = connections.pool = {}
+    conn = pool.get(host)
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=TIMEOUT, context=SSL_CONTEXT)
+        pool[host] = conn
+    return conn
+
+def retry_after_seconds(headers, default):
+    """Seconds to wait per a Retry-After header (delta-seconds or HTTP-date)"""
+    value = (headers.get("Retry-After") or "").strip() if headers else ""
+    if value.isdigit():
+        return int(value)
+    if value:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+def pause_all_workers(seconds):
+    """Make every worker wait the given time before its next request"""
+    global rate_limited_until
+    with lock:
+        rate_limited_until = max(rate_limited_until, time.monotonic() + seconds)
+
+def wait_for_rate_limit():
+    """Sleep out any pause set by pause_all_workers"""
+    while True:
+        with lock:
+            remaining = rate_limited_until - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+def copy_body(body, f):
+    """Write a response body to f through one reused 64KB buffer.
+
+    readinto() fills the same buffer every time, so no bytes object is
+    allocated per chunk the way read()-based copyfileobj does.
+    """
+    buf = bytearray(65536)
+    view = memoryview(buf)
+    while True:
+        n = body.readinto(view)
+        if not n:
+            break
+        f.write(view[:n])
+
+def fetch_to_file(url, headers, local_path):
+    """GET url over a reused connection into local_path.
+
+    The body is streamed in 64KB chunks to a .part file that is renamed into
+    place once complete, so an interrupted download never looks finished.
+    Returns (size, etag, last_modified); size is None when a conditional
+    request came back 304 and local_path was left alone.
+    """
+    partial = local_path.with_name(local_path.name + ".part")
+    for _ in range(MAX_REDIRECTS):
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        conn = get_connection(parsed.netloc)
+        wait_for_rate_limit()
+        limiter.acquire()
+        try:
+            conn.request("GET", target, headers=headers)
+            response = conn.getresponse()
+            if response.status == 429:
+                limiter.throttle()
+            elif response.status < 400:
+                limiter.success()
+            if response.status >= 300:
+                response.read()
+            else:
+                # Sent gzipped when we ask for it; stored decoded
+                with open(partial, 'wb') as f:
+                    if response.getheader("Content-Encoding") == "gzip":
+                        copy_body(gzip.GzipFile(fileobj=response), f)
+                    elif response.length is not None and response.length <= SMALL_BODY_BYTES:
+                        # Known and small: one read and one write beat a loop
+                        f.write(response.read())
+                    else:
+                        copy_body(response, f)
+                    size = f.tell()
+        except (http.client.HTTPException, OSError, EOFError):
+            # Drop the broken socket; the next request reconnects.
+            conn.close()
+            partial.unlink(missing_ok=True)
+            raise
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            continue
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        if response.status == 304:
+            return None, etag, last_modified
+        if response.status >= 300:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        os.replace(partial, local_path)
+        return size, etag, last_modified
+    raise urllib.error.URLError(f"too many redirects for {url}")
 
 def get_all_snapshots():
     """Get all unique URLs from Wayback Machine CDX API"""
     print("Fetching URL list from Wayback Machine CDX API...")
 
+    # Only the columns we read, and revisit records (which replay as empty
+    # bodies) are dropped by the server rather than fetched and discarded
     params = {
         "url": "hero.page/*",
         "output": "json",
+        "fl": "original,timestamp,digest,mimetype,length",
         "collapse": "urlkey",
-        "filter": "statuscode:200",
         "limit": "10000"
     }
 
-    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode(params)}"
-    ctx = get_ssl_context()
+    filters = [("filter", "statuscode:200"), ("filter", "!mimetype:warc/revisit")]
+    url = f"{WAYBACK_CDX_API}?{urllib.parse.urlencode([*params.items(), *filters])}"
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-            with urllib.request.urlopen(req, context=ctx, timeout=60) as response:
-                data = json.loads(response.read().decode())
+            req = urllib.request.Request(url, headers={
+                "User-Agent": "Mozilla/5.0",
+                "Accept-Encoding": "gzip",
+            })
+            with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=60) as response:
+                body = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                data = json_loads(body)
                 return data[1:] if len(data) > 1 else []
         except Exception as e:
             print(f"Attempt {attempt + 1} failed: {e}")
@@ -60,17 +242,102 @@ def get_all_snapshots():
 
     return []
 
-def download_file(args):
-    """Download a file from Wayback Machine"""
-    url, timestamp, idx, total = args
-
-    # Rate limiting
-    time.sleep(REQUEST_DELAY)
-
-    # Create the wayback URL for raw content
-    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
+def scan_existing(output_dir):
+    """Relative paths of every non-empty file under output_dir"""
+    existing = set()
+    for root, _, files in os.walk(output_dir):
+        rel_root = os.path.relpath(root, output_dir)
+        for name in files:
+            if name.startswith(MANIFEST_DB.name):
+                continue  # The manifest and its -wal/-shm files
+            try:
+                if os.path.getsize(os.path.join(root, name)) > 0:
+                    existing.add(os.path.normpath(os.path.join(rel_root, name)))
+            except OSError:
+                pass
+    return existing
+
+def load_manifest():
+    """Open the manifest database.
+
+    Returns {url: (timestamp, etag, last_modified)} for every URL it lists
+    as done, or None if it couldn't be opened.
+    """
+    global manifest_db
+    try:
+        db = sqlite3.connect(MANIFEST_DB, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS done (url TEXT PRIMARY KEY, timestamp TEXT,"
+            " digest TEXT, size INTEGER, mtime REAL, etag TEXT, last_modified TEXT)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(done)")}
+        for column in ("etag", "last_modified"):
+            if column not in columns:  # Manifests from before validators were kept
+                db.execute(f"ALTER TABLE done ADD COLUMN {column} TEXT")
+        # Holds a "scanned" row once files found by a directory scan are all in done
+        db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        rows = db.execute("SELECT url, timestamp, etag, last_modified FROM done").fetchall()
+    except sqlite3.Error as e:
+        print(f"Manifest unavailable, resuming from a directory scan: {e}")
+        return None
+    manifest_db = db
+    return {url: tuple(validators) for url, *validators in rows}
 
-    # Determine local file path
+def record_download(url, timestamp, digest, size, etag=None, last_modified=None):
+    """Add a finished download to the manifest; the caller holds lock"""
+    if manifest_db is None:
+        return
+    try:
+        manifest_db.execute(
+            "INSERT OR REPLACE INTO done (url, timestamp, digest, size, mtime, etag, last_modified)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, timestamp, digest, size, time.time(), etag, last_modified),
+        )
+    except sqlite3.Error as e:
+        print(f"Manifest write failed: {e}")
+
+def manifest_scanned():
+    """Whether the manifest already covers every file a directory scan would find"""
+    try:
+        return manifest_db.execute("SELECT 1 FROM state WHERE key = 'scanned'").fetchone() is not None
+    except sqlite3.Error:
+        return False
+
+def seed_manifest(tasks, done, existing):
+    """Record tasks whose files the directory scan found, then mark the scan done.
+
+    Everything goes in one transaction, so an interrupted run either leaves
+    the manifest unmarked (and the next run scans again) or complete.
+    Returns False if it couldn't be written.
+    """
+    found = [
+        task for task in tasks
+        if task[0] not in done and os.path.normpath(task[3]) in existing
+    ]
+    try:
+        with lock:
+            manifest_db.execute("BEGIN")
+            try:
+                manifest_db.executemany(
+                    "INSERT OR REPLACE INTO done (url, timestamp, digest, mtime) VALUES (?, ?, ?, ?)",
+                    [(url, timestamp, digest, time.time()) for url, timestamp, digest, *_ in found],
+                )
+                manifest_db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('scanned', ?)", (str(time.time()),))
+                manifest_db.execute("COMMIT")
+            except BaseException:
+                manifest_db.execute("ROLLBACK")
+                raise
+    except sqlite3.Error as e:
+        print(f"Manifest write failed: {e}")
+        return False
+    for url, timestamp, *_ in found:
+        done[url] = (timestamp, None, None)
+    return True
+
+def url_to_path(url):
+    """Local path, relative to OUTPUT_DIR, for an archived URL"""
     parsed = urllib.parse.urlparse(url)
     path = parsed.path.strip("/")
 
@@ -84,39 +351,67 @@ def download_file(args):
         path = path.rstrip("/") + "/index.html"
 
     # Clean up path - remove problematic characters
-    for char in ['%', ':', '?', '*', '"', '<', '>', '|', '\\']:
-        path = path.replace(char, "_")
+    return path.translate(UNSAFE_PATH_CHARS)
 
-    local_path = OUTPUT_DIR / path
+def download_file(args, done=None, existing=frozenset()):
+    """Download a file from Wayback Machine.
 
-    # Skip if already downloaded
-    if local_path.exists() and local_path.stat().st_size > 0:
+    URLs that done (from the manifest) lists at this timestamp and paths in
+    existing (from a directory scan) are skipped. URLs it lists at an older
+    timestamp are fetched conditionally on their stored validators.
+    """
+    url, timestamp, digest, path, idx, total = args
+
+    previous = done.get(url) if done else None
+    if previous and previous[0] == timestamp:
         with lock:
             stats["skipped"] += 1
         return None
 
-    # Create directory
-    local_path.parent.mkdir(parents=True, exist_ok=True)
+    # Create the wayback URL for raw content
+    wayback_url = WAYBACK_RAW_URL.format(timestamp=timestamp, url=url)
+
+    local_path = OUTPUT_DIR / path
+
+    # Skip if already downloaded (checked against the startup scan, not the disk)
+    if os.path.normpath(path) in existing:
+        with lock:
+            stats["skipped"] += 1
+        return None
 
-    ctx = get_ssl_context()
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+        "Accept-Encoding": "gzip",
+    }
+    # A newer capture of something we already have: a 304 means it is
+    # unchanged and only needs its manifest row moved to the new timestamp
+    if previous and local_path.exists():
+        _, etag, last_modified = previous
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
 
     for attempt in range(MAX_RETRIES):
         try:
-            req = urllib.request.Request(wayback_url, headers={
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
-            })
-            with urllib.request.urlopen(req, context=ctx, timeout=TIMEOUT) as response:
-                content = response.read()
-                with open(local_path, 'wb') as f:
-                    f.write(content)
+            size, etag, last_modified = fetch_to_file(wayback_url, headers, local_path)
+            if size is None:
+                size = local_path.stat().st_size
+                etag = etag or previous[1]
+                last_modified = last_modified or previous[2]
                 with lock:
-                    stats["downloaded"] += 1
-                return f"[{idx}/{total}] OK: {path[:55]} ({len(content)}b)"
+                    stats["skipped"] += 1
+                    record_download(url, timestamp, digest, size, etag, last_modified)
+                return None
+            with lock:
+                stats["downloaded"] += 1
+                record_download(url, timestamp, digest, size, etag, last_modified)
+            return f"[{idx}/{total}] OK: {path[:55]} ({size}b)"
         except urllib.error.HTTPError as e:
             if e.code == 429:  # Too Many Requests
-                wait_time = 30 * (attempt + 1)
-                print(f"Rate limited, waiting {wait_time}s...")
-                time.sleep(wait_time)
+                wait_time = retry_after_seconds(e.headers, 30 * (attempt + 1))
+                print(f"Rate limited, all workers waiting {wait_time:.0f}s...")
+                pause_all_workers(wait_time)
             elif attempt < MAX_RETRIES - 1:
                 time.sleep(3 * (attempt + 1))
         except Exception as e:
@@ -132,10 +427,18 @@ def download_file(args):
         stats["failed"] += 1
     return None
 
+def create_directories(output_dir, paths):
+    """Create each distinct parent directory of paths once, before any download"""
+    for directory in {os.path.dirname(path) for path in paths}:
+        try:
+            (output_dir / directory).mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass  # e.g. a file already holds the name; those downloads fail and are reported
+
 def main():
     print("=" * 60)
     print("Safe Wayback Machine Downloader for hero.page")
-    print(f"Using {MAX_WORKERS} workers with {REQUEST_DELAY}s delay")
+    print(f"Using {MAX_WORKERS} workers at up to {MAX_RATE} requests/s")
     print("=" * 60)
 
     # Get all snapshots
@@ -149,16 +452,27 @@ def main():
     # Create output directory
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Check how many already exist
-    existing = len(list(OUTPUT_DIR.rglob("*")))
-    print(f"Already have {existing} files")
-
-    # Prepare download tasks
-    tasks = []
-    for idx, row in enumerate(snapshots, 1):
-        url = row[2]
-        timestamp = row[1]
-        tasks.append((url, timestamp, idx, len(snapshots)))
+    # Check how many already exist. The directory is scanned until the
+    # manifest has recorded what a scan finds; after that it is trusted alone.
+    done = load_manifest()
+    existing = frozenset()
+    if done is not None and manifest_scanned():
+        print(f"Already have {len(done)} files (from {MANIFEST_DB})")
+    else:
+        existing = frozenset(scan_existing(OUTPUT_DIR))
+        print(f"Already have {len(existing)} files")
+    done = done or {}
+
+    # Prepare download tasks, deriving each local path once here. Files in
+    # the same directory are queued together, so the workers' writes stay
+    # in a few directories at a time.
+    entries = [(row[0], row[1], row[2], url_to_path(row[0])) for row in snapshots]
+    entries.sort(key=lambda entry: os.path.dirname(entry[3]))
+    tasks = [(*entry, idx, len(entries)) for idx, entry in enumerate(entries, 1)]
+
+    if manifest_db is not None and not manifest_scanned() and seed_manifest(tasks, done, existing):
+        existing = frozenset()  # Now covered by done
+    create_directories(OUTPUT_DIR, (task[3] for task in tasks))
 
     print(f"\nDownloading {len(tasks)} files...")
     print("-" * 60)
@@ -167,7 +481,7 @@ def main():
 
     # Use ThreadPoolExecutor for parallel downloads
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_file, task): task for task in tasks}
+        futures = {executor.submit(download_file, task, done, existing): task for task in tasks}
 
         for future in as_completed(futures):
             result = future.result()
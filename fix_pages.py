@@ -3,14 +3,28 @@
 Download rendered versions of pages and fix links to work locally
 """
 import os
+import email.utils
+import mmap
 import re
-import time
-import urllib.request
+import http.client
+import urllib.error
+import urllib.parse
 import ssl
+import threading
+import time
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 OUTPUT_DIR = Path("hero_page_site")
 WAYBACK_RAW_URL = "https://web.archive.org/web/20250519133509id_/https://hero.page{path}"
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "4"))  # Pages fetched at once
+# All workers draw from one limiter, so this caps the total request rate
+MAX_RATE = float(os.environ.get("MAX_RATE", "2"))  # requests per second
+MAX_RETRIES = 3
+MAX_REDIRECTS = 5
+TIMEOUT = 60
+# Wayback-wrapped and direct hero.page URLs; dropping the origin leaves a local path
+HERO_URL_RE = re.compile(r"https://(?:web\.archive\.org/web/\d+(?:id_)?/https://)?hero\.page")
 
 # Key pages to download rendered versions
 KEY_PAGES = [
@@ -36,11 +50,145 @@ SIDEBAR_PAGES = [
 
 ALL_PAGES = KEY_PAGES + SIDEBAR_PAGES
 
-def get_ssl_context():
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    return ctx
+# Shared by every request; SSLContext is safe to reuse across threads
+SSL_CONTEXT = ssl.create_default_context()
+
+# Keep-alive connections, one set per thread
+connections = threading.local()
+
+# Monotonic time until which every worker holds off, set from a 429's Retry-After
+rate_limited_until = 0.0
+rate_limit_lock = threading.Lock()
+
+class RateLimiter:
+    """Token bucket shared by every worker, paced with AIMD.
+
+    Requests are spaced 1/rate seconds apart. A 429 halves the rate (down
+    to min_rate); about a second's worth of successes adds one request per
+    second back, up to max_rate.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+        self.max_rate = self.rate = float(max_rate)
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Back off after a 429"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.successes = 0
+
+    def success(self):
+        """Creep back toward max_rate after a successful response"""
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+limiter = RateLimiter(MAX_RATE)
+
+def retry_after_seconds(headers, default):
+    """Seconds to wait per a Retry-After header (delta-seconds or HTTP-date)"""
+    value = (headers.get("Retry-After") or "").strip() if headers else ""
+    if value.isdigit():
+        return int(value)
+    if value:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+def pause_all_workers(seconds):
+    """Make every worker wait the given time before its next request"""
+    global rate_limited_until
+    with rate_limit_lock:
+        rate_limited_until = max(rate_limited_until, time.monotonic() + seconds)
+
+def wait_for_rate_limit():
+    """Sleep out any pause set by pause_all_workers"""
+    while True:
+        with rate_limit_lock:
+            remaining = rate_limited_until - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+def get_connection(host):
+    """Return this thread's persistent HTTPS connection to host"""
+    pool = getattr(connections, "pool", None)
+    if pool is None:
+        pool = connections.pool = {}
+    conn = pool.get(host)
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=TIMEOUT, context=SSL_CONTEXT)
+        pool[host] = conn
+    return conn
+
+def send_request(conn, target, headers):
+    """GET target on a keep-alive connection and return the response.
+
+    A reused connection may have been dropped by the server while idle, so
+    a failure before any response arrives is retried once on a fresh socket.
+    """
+    reused = conn.sock is not None
+    try:
+        conn.request("GET", target, headers=headers)
+        return conn.getresponse()
+    except (http.client.HTTPException, OSError):
+        conn.close()
+        if not reused:
+            raise
+    # close() left it unconnected, so this request opens a new socket
+    conn.request("GET", target, headers=headers)
+    return conn.getresponse()
+
+def fetch_bytes(url, headers):
+    """GET url over a reused connection, following redirects"""
+    for _ in range(MAX_REDIRECTS):
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        conn = get_connection(parsed.netloc)
+        wait_for_rate_limit()
+        limiter.acquire()
+        try:
+            response = send_request(conn, target, headers)
+            if response.status == 429:
+                limiter.throttle()
+            elif response.status < 400:
+                limiter.success()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            # Drop the broken socket; the next request reconnects.
+            conn.close()
+            raise
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            continue
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return content
+    raise urllib.error.URLError(f"too many redirects for {url}")
 
 def download_rendered_page(path):
     """Download a rendered page from Wayback Machine"""
@@ -53,75 +201,71 @@ def download_rendered_page(path):
         clean_path = path.strip("/")
         local_path = OUTPUT_DIR / clean_path / "index.html"
 
-    print(f"Downloading: {path} -> {local_path}")
-
-    ctx = get_ssl_context()
-
     try:
-        req = urllib.request.Request(url, headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-        })
-        with urllib.request.urlopen(req, context=ctx, timeout=60) as response:
-            content = response.read().decode('utf-8', errors='ignore')
+        for attempt in range(MAX_RETRIES):
+            try:
+                content = fetch_bytes(url, {
+                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
+                }).decode('utf-8', errors='ignore')
+                break
+            except urllib.error.HTTPError as e:
+                if e.code != 429 or attempt == MAX_RETRIES - 1:  # Too Many Requests
+                    raise
+                wait_time = retry_after_seconds(e.headers, 30 * (attempt + 1))
+                print(f"Rate limited, all workers waiting {wait_time:.0f}s...")
+                pause_all_workers(wait_time)
 
-            # Fix links to work locally
-            content = fix_links(content)
+        # Fix links to work locally
+        content = fix_links(content)
 
-            # Create directory if needed
-            local_path.parent.mkdir(parents=True, exist_ok=True)
+        # Create directory if needed
+        local_path.parent.mkdir(parents=True, exist_ok=True)
 
-            with open(local_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+        with open(local_path, 'w', encoding='utf-8') as f:
+            f.write(content)
 
-            print(f"  OK: {len(content)} bytes")
-            return True
+        # One line per page, so output from parallel downloads doesn't interleave
+        print(f"OK: {path} -> {local_path} ({len(content)} bytes)")
+        return True
     except Exception as e:
-        print(f"  FAILED: {e}")
+        print(f"FAILED: {path} - {e}")
         return False
 
 def fix_links(content):
     """Fix links to work locally"""
-    # Remove Wayback Machine wrapper URLs
-    content = re.sub(
-        r'https://web\.archive\.org/web/\d+id_/https://hero\.page',
-        '',
-        content
-    )
-    content = re.sub(
-        r'https://web\.archive\.org/web/\d+/https://hero\.page',
-        '',
-        content
-    )
-    # Fix direct hero.page links
-    content = re.sub(
-        r'https://hero\.page/',
-        '/',
-        content
-    )
-    content = re.sub(
-        r'https://hero\.page',
-        '',
-        content
-    )
-    return content
+    return HERO_URL_RE.sub('', content)
+
+def fix_page_file(html_file):
+    """Fix links in one HTML file, returning 1 if it was rewritten"""
+    try:
+        # Every rewritten URL contains this, so files without it are left
+        # alone. The check runs on a read-only mapping of the file, so a
+        # clean file is never copied into Python at all. (Empty files can't
+        # be mapped; the ValueError lands in the handler below.)
+        with open(html_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(b'https://hero.page') == -1:
+                    return 0
+                data = mm[:]
+
+        content = data.decode('utf-8', errors='ignore')
+        fixed = fix_links(content)
+
+        if fixed != content:
+            with open(html_file, 'w', encoding='utf-8') as f:
+                f.write(fixed)
+            return 1
+    except Exception as e:
+        pass
+    return 0
 
 def fix_existing_pages():
     """Fix links in all existing HTML files"""
     print("\nFixing links in existing pages...")
-    count = 0
-    for html_file in OUTPUT_DIR.rglob("*.html"):
-        try:
-            with open(html_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-
-            fixed = fix_links(content)
-
-            if fixed != content:
-                with open(html_file, 'w', encoding='utf-8') as f:
-                    f.write(fixed)
-                count += 1
-        except Exception as e:
-            pass
+    # Pure CPU and independent per file, so spread across processes
+    html_files = list(OUTPUT_DIR.rglob("*.html"))
+    with ProcessPoolExecutor() as executor:
+        count = sum(executor.map(fix_page_file, html_files, chunksize=32))
 
     print(f"Fixed {count} files")
 
@@ -130,15 +274,12 @@ def main():
     print("Downloading rendered pages from Wayback Machine")
     print("=" * 50)
 
-    success = 0
-    failed = 0
-
-    for path in ALL_PAGES:
-        if download_rendered_page(path):
-            success += 1
-        else:
-            failed += 1
-        time.sleep(1)  # Rate limiting
+    # Pages are independent, so their round trips overlap; each worker
+    # keeps its own connection alive across the pages it fetches
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(download_rendered_page, ALL_PAGES))
+    success = sum(results)
+    failed = len(results) - success
 
     print(f"\nDownloaded: {success}, Failed: {failed}")
 
@@ -3,9 +3,10 @@
 import csv
 import os
 import re
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
 STATIC_DIR = Path(os.environ.get("STATIC_DIR", "static_pages"))
 CSV_PATH = os.environ.get("CSV_PATH", "")
@@ -16,9 +17,20 @@ SITEMAP_HOSTS = [
     if host.strip()
 ]
 INLINE_STYLE_RE = re.compile(
-    r'<style[^>]*id="inline-styles-from-cssom"[^>]*>(.*?)</style>',
+    rb'<style[^>]*id="inline-styles-from-cssom"[^>]*>(.*?)</style>',
     re.DOTALL,
 )
+# The CSSOM style tag lives in <head>, so the first chunk almost always has it.
+INLINE_STYLE_SCAN_BYTES = 65536
+XML_ESCAPE_TABLE = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "'": "&apos;",
+    }
+)
 
 
 def normalize_path(raw_path):
@@ -48,49 +60,77 @@ def load_csv_paths(csv_path, allowed_hosts):
         return paths, skipped_hosts
 
     with open(csv_file, newline="", encoding="utf-8") as handle:
-        reader = csv.DictReader(handle)
+        reader = csv.reader(handle)
+        header = next(reader, [])
+        url_idx = next(
+            (header.index(name) for name in ("URL", "Url", "url") if name in header),
+            None,
+        )
+        if url_idx is None:
+            return paths, skipped_hosts
+
+        # Ahrefs exports repeat URLs; parse each distinct one only once.
+        parsed_urls = {}
         for row in reader:
-            url = row.get("URL") or row.get("Url") or row.get("url")
+            if url_idx >= len(row):
+                continue
+            url = row[url_idx]
             if not url:
                 continue
-            parsed = urlparse(url.strip())
-            host = parsed.hostname or ""
+            parsed = parsed_urls.get(url)
+            if parsed is None:
+                parts = urlsplit(url.strip())
+                parsed = parsed_urls[url] = (
+                    parts.hostname or "",
+                    normalize_path(parts.path or "/"),
+                )
+            host, path = parsed
             if allowed_hosts and host not in allowed_hosts:
                 skipped_hosts[host] = skipped_hosts.get(host, 0) + 1
                 continue
-            path = normalize_path(parsed.path or "/")
             paths.add(path)
 
     return paths, skipped_hosts
 
 
+def iter_html_files(root):
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_html_files(entry.path)
+            elif entry.name.endswith(".html"):
+                yield entry.path
+
+
 def path_from_html_file(static_dir, html_file):
-    try:
-        rel = html_file.relative_to(static_dir)
-    except ValueError:
+    prefix = os.path.join(os.fspath(static_dir), "")
+    html_file = os.fspath(html_file)
+    if not html_file.startswith(prefix):
         return None
-    if rel.parts and rel.parts[0] == "static":
+    parts = html_file[len(prefix) :].split(os.sep)
+    if parts[0] == "static":
         return None
-    if rel.name == "index.html":
-        if rel.parent == Path("."):
-            path = "/"
-        else:
-            path = "/" + "/".join(rel.parent.parts)
+    if parts[-1] == "index.html":
+        path = "/" + "/".join(parts[:-1])
     else:
-        path = "/" + "/".join(rel.parts)
+        path = "/" + "/".join(parts)
     return normalize_path(path)
 
 
 def has_inline_css(html_file):
     try:
-        content = html_file.read_text(encoding="utf-8", errors="ignore")
+        with open(html_file, "rb") as handle:
+            content = handle.read(INLINE_STYLE_SCAN_BYTES)
+            match = INLINE_STYLE_RE.search(content)
+            if not match and len(content) == INLINE_STYLE_SCAN_BYTES:
+                content += handle.read()
+                match = INLINE_STYLE_RE.search(content)
     except Exception:
         return False
-    match = INLINE_STYLE_RE.search(content)
     if not match:
         return False
     inline_css = match.group(1).strip()
-    return bool(inline_css and "{" in inline_css)
+    return bool(inline_css and b"{" in inline_css)
 
 
 def load_static_paths(static_dir):
@@ -99,46 +139,57 @@ def load_static_paths(static_dir):
     if not static_dir.exists():
         return paths, valid_paths
 
-    for html_file in static_dir.rglob("*.html"):
+    candidates = []
+    for html_file in iter_html_files(os.fspath(static_dir)):
         path = path_from_html_file(static_dir, html_file)
         if not path:
             continue
         paths.add(path)
-        if has_inline_css(html_file):
-            valid_paths.add(path)
+        candidates.append((path, html_file))
+
+    if not candidates:
+        return paths, valid_paths
+
+    # The inline CSS scan is regex-bound, so spread it across processes.
+    html_files = [html_file for _, html_file in candidates]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(has_inline_css, html_files, chunksize=64)
+        for (path, _), valid in zip(candidates, results):
+            if valid:
+                valid_paths.add(path)
 
     return paths, valid_paths
 
 
 def escape_xml(text):
-    return (
-        text.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&apos;")
-    )
+    return text.translate(XML_ESCAPE_TABLE)
 
 
 def generate_sitemap(domain, paths):
-    today = datetime.now().strftime("%Y-%m-%d")
-
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    today = date.today().isoformat()
+
+    # Only the path varies per entry; the rest of each <url> block is fixed.
+    url_prefix = f"  <url>\n    <loc>https://{domain}"
+    url_suffix = (
+        "</loc>\n"
+        f"    <lastmod>{today}</lastmod>\n"
+        "    <changefreq>monthly</changefreq>\n"
+        "    <priority>0.8</priority>\n"
+        "  </url>\n"
+    )
 
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    ]
+    append = parts.append
     for path in paths:
-        path = escape_xml(path)
-        xml += (
-            "  <url>\n"
-            f"    <loc>https://{domain}{path}</loc>\n"
-            f"    <lastmod>{today}</lastmod>\n"
-            "    <changefreq>monthly</changefreq>\n"
-            "    <priority>0.8</priority>\n"
-            "  </url>\n"
-        )
+        append(url_prefix)
+        append(escape_xml(path))
+        append(url_suffix)
 
-    xml += "</urlset>"
-    return xml
+    append("</urlset>")
+    return "".join(parts)
 
 
 if __name__ == "__main__":
@@ -3,30 +3,71 @@
 Proxy server that fetches hero.page content from Wayback Machine
 and serves it locally for SEO purposes.
 """
+import asyncio
+import http.client
 import http.server
-import socketserver
-import urllib.request
 import urllib.parse
 import ssl
 import os
+import re
+import gzip
 import hashlib
 import json
+import logging
+import logging.handlers
+import queue
+import signal
+import sqlite3
+import sys
+import tempfile
+import email.utils
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from types import MappingProxyType
 import threading
-from content_utils import fix_content
+import time
+from content_utils import fix_content, fix_content_bytes
+
+# orjson parses large CDX listings several times faster; json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Request threads only enqueue log records; the listener thread started by
+# run_server does the stdout writes, so handlers never wait on the console.
+logger = logging.getLogger("proxy")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
 
 # Playwright for rendering JavaScript
 try:
-    from playwright.sync_api import sync_playwright
+    from playwright.async_api import async_playwright
     PLAYWRIGHT_AVAILABLE = True
 except ImportError:
     PLAYWRIGHT_AVAILABLE = False
-    print("[WARNING] Playwright not available - pages will not render JavaScript")
 
 PORT = int(os.environ.get("PORT", 8000))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "64"))
+# Processes sharing the listening socket, each with SERVER_WORKERS threads
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", "1"))
+# Idle keep-alive connections are dropped after this, freeing their worker.
+# An idle connection holds a pool thread, so keep this short.
+KEEPALIVE_TIMEOUT = int(os.environ.get("KEEPALIVE_TIMEOUT", "2"))
+# Static files at least this large are streamed with sendfile, not read into memory
+SENDFILE_MIN_BYTES = 64 * 1024
 CACHE_DIR = Path("cache")
+# Pre-rendered pages and assets served as-is, ahead of any remote fetch
+STATIC_ROOT = "static_pages"
 WAYBACK_TIMESTAMP = "20240419175536"  # Full timestamp with rendered content
+WAYBACK_CDX_URL = "https://web.archive.org/cdx/search/cdx"
 ORIGINAL_DOMAIN = "hero.page"
 LOCAL_DOMAIN = os.environ.get("DOMAIN", "localhost:8000")  # Set DOMAIN env var in production
 STATIC_ONLY = os.environ.get("STATIC_ONLY", "0").lower() in ("1", "true", "yes")
@@ -37,307 +78,1274 @@ ALLOW_REMOTE_FETCH = not STATIC_ONLY and os.environ.get("ALLOW_REMOTE_FETCH", "1
 )
 QUIBEY_WAIT_UNTIL = os.environ.get("QUIBEY_WAIT_UNTIL", "domcontentloaded")
 QUIBEY_TIMEOUT_MS = int(os.environ.get("QUIBEY_TIMEOUT_MS", "60000"))
-QUIBEY_POST_WAIT_MS = int(os.environ.get("QUIBEY_POST_WAIT_MS", "1500"))
+QUIBEY_POST_WAIT_MS = int(os.environ.get("QUIBEY_POST_WAIT_MS", "1000"))
 QUIBEY_STYLE_WAIT_MS = int(os.environ.get("QUIBEY_STYLE_WAIT_MS", "5000"))
+BROWSER_RECYCLE_RENDERS = int(os.environ.get("BROWSER_RECYCLE_RENDERS", "200"))
+# Pages rendered at once on the shared browser
+RENDER_CONCURRENCY = int(os.environ.get("RENDER_CONCURRENCY", "4"))
+# A handler gives up on a render (queueing included) after this and treats it as failed
+RENDER_TIMEOUT_SECONDS = (QUIBEY_TIMEOUT_MS + QUIBEY_STYLE_WAIT_MS + QUIBEY_POST_WAIT_MS) / 1000 + 30
+CHROMIUM_ARGS = ["--disable-dev-shm-usage", "--disable-gpu"]
+# Only the rendered HTML is kept, so skip anything that cannot change it.
+# Styled-components/emotion styles are inline <style> tags and still load.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media", "stylesheet"})
+BLOCKED_URL_PARTS = (
+    "google-analytics",
+    "googletagmanager",
+    "doubleclick",
+    "segment.io",
+    "hotjar",
+    "facebook.net",
+)
+
+# Runs in the rendered page: waits (best effort) for styled-components/emotion
+# styles, copies their CSSOM rules into a real <style> tag so they survive
+# serialization, and returns the document HTML.
+QUIBEY_RENDER_JS = """async ({ styleWaitMs, postWaitMs }) => {
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+    const hasStyles = () => Array.from(
+        document.querySelectorAll('style[data-styled], style[data-emotion]')
+    ).some(style => style.textContent && style.textContent.trim().length > 0);
+
+    const deadline = Date.now() + styleWaitMs;
+    while (Date.now() < deadline && !hasStyles()) {
+        await sleep(50);
+    }
+    await sleep(postWaitMs);
+
+    try {
+        const rules = [];
+        for (const sheet of Array.from(document.styleSheets || [])) {
+            const owner = sheet.ownerNode;
+            if (!owner) continue;
+            const isStyled = owner.hasAttribute && (
+                owner.hasAttribute('data-styled') || owner.hasAttribute('data-emotion')
+            );
+            if (!isStyled) continue;
+            try {
+                for (const rule of Array.from(sheet.cssRules || [])) {
+                    if (rule && rule.cssText) {
+                        rules.push(rule.cssText);
+                    }
+                }
+            } catch (err) {
+                // Ignore cross-origin stylesheets.
+            }
+        }
+        if (rules.length) {
+            let tag = document.getElementById('inline-styles-from-cssom');
+            if (!tag) {
+                tag = document.createElement('style');
+                tag.id = 'inline-styles-from-cssom';
+                document.head.appendChild(tag);
+            }
+            tag.textContent = rules.join('\\n');
+        }
+    } catch (err) {
+        // Inlining is best effort; serialize the page as it is.
+    }
+
+    const doctype = document.doctype
+        ? new XMLSerializer().serializeToString(document.doctype)
+        : '';
+    return doctype + document.documentElement.outerHTML;
+}"""
+
+# Renders run as coroutines on one event loop thread, started on first use, that
+# owns every Playwright object and keeps a single browser alive between requests.
+# Up to RENDER_CONCURRENCY pages render on it at once.
+render_loop = None
+render_loop_lock = threading.Lock()
+render_semaphore = None
+_playwright = None
+_browser = None
+_browser_renders = 0
+_browser_lock = None
+# Renders in progress per browser, so a recycled browser closes once they finish
+_browser_users = {}
+
+# Browser/CDN caching policy; fingerprinted build assets never change in place
+DEFAULT_CACHE_CONTROL = "public, max-age=3600, stale-while-revalidate=86400"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{8,}\.")
+
+# fix_content is CPU-bound regex work, so it runs in worker processes instead of
+# holding the GIL on handler threads. Spawned, because forking a process that
+# runs Playwright and handler threads is unsafe.
+FIX_CONTENT_WORKERS = int(os.environ.get("FIX_CONTENT_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Seconds to wait for a worker before fixing the page on the handler thread
+FIX_CONTENT_TIMEOUT = 20
+# Created by run_server, so spawned workers importing this module don't build
+# pools of their own; until then pages are fixed inline.
+fix_content_executor = None
+fix_content_executor_lock = threading.Lock()
+
+# Cache files are stored gzipped and sent as-is to clients that accept gzip
+CACHE_COMPRESS_LEVEL = int(os.environ.get("CACHE_COMPRESS_LEVEL", "6"))
+
+# In-memory LRU of hot cached pages in front of CACHE_DIR: path -> (gzipped body, etag, mtime)
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("MEMORY_CACHE_MAX_ENTRIES", "256"))
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get("MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+memory_cache = OrderedDict()
+memory_cache_bytes = 0
+memory_cache_lock = threading.Lock()
+
+# Disk cache size cap; least recently used files are deleted past it
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+disk_cache_bytes = 0
+disk_cache_trimming = False
+disk_cache_lock = threading.Lock()
+
+# Recently failed fetches are answered with a 404 without going upstream:
+# path -> time the entry expires. Only real misses (404/410) get the long TTL;
+# upstream errors, rate limits and timeouts expire sooner, or per Retry-After.
+# Entries are mirrored to SQLite so they survive a restart. The database sits
+# outside CACHE_DIR, whose scan and trim would count and delete it.
+NEGATIVE_CACHE_TTL = int(os.environ.get("NEGATIVE_CACHE_TTL", "3600"))
+NEGATIVE_CACHE_ERROR_TTL = int(os.environ.get("NEGATIVE_CACHE_ERROR_TTL", "300"))
+NEGATIVE_CACHE_MAX_ENTRIES = 10000
+NEGATIVE_CACHE_DB = os.environ.get("NEGATIVE_CACHE_DB", "negative_cache.sqlite3")
+negative_cache = {}
+negative_cache_db = None
+negative_cache_lock = threading.Lock()
+
+# Single-flight for cold fetches: path -> Event set once the first fetch is done
+INFLIGHT_WAIT_SECONDS = int(os.environ.get("INFLIGHT_WAIT_SECONDS", "120"))
+inflight = {}
+inflight_lock = threading.Lock()
+
+# Cached pages older than this are revalidated against upstream in the background
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+REVALIDATE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="revalidate")
+revalidating = set()
+
+USER_AGENT = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+
+# Idle keep-alive HTTPS connections for Wayback fetches, per host
+WAYBACK_POOL_SIZE = int(os.environ.get("WAYBACK_POOL_SIZE", "16"))
+WAYBACK_TIMEOUT = 45
+MAX_REDIRECTS = 5
+SSL_CONTEXT = ssl.create_default_context()
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+# Exact snapshot timestamps from one CDX query at startup: path -> timestamp.
+# Unlisted paths use WAYBACK_TIMESTAMP and follow Wayback's redirect.
+wayback_timestamps = {}
 
 # Create cache directory
 CACHE_DIR.mkdir(exist_ok=True)
 
-def get_ssl_context():
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    return ctx
+def file_etag(st):
+    """Strong validator for a cache file; they are only ever rewritten whole"""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def identity_etag(etag):
+    """ETag for the decompressed form of a gzipped cache file"""
+    return etag[:-1] + '-identity"'
+
+def memory_cache_get(path):
+    """Return the (body, etag, mtime) held in memory for path, or None"""
+    with memory_cache_lock:
+        entry = memory_cache.get(path)
+        if entry is not None:
+            memory_cache.move_to_end(path)
+        return entry
+
+def memory_cache_put(path, body, etag, mtime):
+    """Remember a cached page, evicting least recently used entries past the limits"""
+    global memory_cache_bytes
+    if len(body) > MEMORY_CACHE_MAX_BYTES // 8:
+        return  # Large pages would churn the whole cache; serve them from disk
+    with memory_cache_lock:
+        previous = memory_cache.pop(path, None)
+        if previous is not None:
+            memory_cache_bytes -= len(previous[0])
+        memory_cache[path] = (body, etag, mtime)
+        memory_cache_bytes += len(body)
+        while len(memory_cache) > MEMORY_CACHE_MAX_ENTRIES or memory_cache_bytes > MEMORY_CACHE_MAX_BYTES:
+            _, (evicted, _, _) = memory_cache.popitem(last=False)
+            memory_cache_bytes -= len(evicted)
 
+def scan_disk_cache():
+    """Return (last_used, size, path) for every file in CACHE_DIR"""
+    entries = []
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                # atime is relatime-granular at best, so a fresh write counts as a use too
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+    return entries
+
+def disk_cache_added(size):
+    """Account for bytes written to CACHE_DIR, trimming in the background past the cap"""
+    global disk_cache_bytes, disk_cache_trimming
+    with disk_cache_lock:
+        disk_cache_bytes += size
+        if disk_cache_bytes <= CACHE_MAX_BYTES or disk_cache_trimming:
+            return
+        disk_cache_trimming = True
+    threading.Thread(target=trim_disk_cache, daemon=True).start()
+
+def trim_disk_cache():
+    """Delete least recently used cache files until the cache is under 90% of its cap"""
+    global disk_cache_bytes, disk_cache_trimming
+    try:
+        with disk_cache_lock:
+            counted = disk_cache_bytes
+        entries = scan_disk_cache()
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = CACHE_MAX_BYTES * 9 // 10
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        logger.info(f"[CACHE] Trimmed disk cache to {total} bytes")
+        with disk_cache_lock:
+            # Keep bytes written during the scan; correct any drift in the running count
+            disk_cache_bytes += total - counted
+    finally:
+        with disk_cache_lock:
+            disk_cache_trimming = False
+
+def negative_cache_hit(path):
+    """Whether a fetch of path failed recently enough to skip upstream"""
+    with negative_cache_lock:
+        expires = negative_cache.get(path)
+        if expires is None:
+            return False
+        if expires > time.time():
+            return True
+        del negative_cache[path]
+        return False
+
+def retry_after_seconds(value):
+    """Seconds to wait per a Retry-After value (delta-seconds or HTTP-date), or None"""
+    value = (value or "").strip()
+    if value.isdigit():
+        return int(value)
+    if value:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def negative_cache_put(path, status, retry_after=None):
+    """Remember a failed fetch, dropping expired (or else the oldest) entries when full"""
+    now = time.time()
+    if status in (404, 410):
+        ttl = NEGATIVE_CACHE_TTL
+    else:
+        # A 429 or 408 says nothing about the page, so retry soon
+        ttl = retry_after_seconds(retry_after)
+        ttl = NEGATIVE_CACHE_ERROR_TTL if ttl is None else min(ttl, NEGATIVE_CACHE_TTL)
+    with negative_cache_lock:
+        full = len(negative_cache) >= NEGATIVE_CACHE_MAX_ENTRIES
+        if full:
+            for expired in [p for p, expires in negative_cache.items() if expires <= now]:
+                del negative_cache[expired]
+            if len(negative_cache) >= NEGATIVE_CACHE_MAX_ENTRIES:
+                del negative_cache[next(iter(negative_cache))]
+        negative_cache[path] = now + ttl
+        # The lock also serializes use of the shared connection
+        if negative_cache_db is not None:
+            try:
+                if full:
+                    negative_cache_db.execute("DELETE FROM negative_cache WHERE expires <= ?", (now,))
+                negative_cache_db.execute(
+                    "INSERT OR REPLACE INTO negative_cache (path, expires) VALUES (?, ?)",
+                    (path, now + ttl),
+                )
+            except sqlite3.Error as e:
+                logger.error(f"[NEGATIVE CACHE ERROR] {e}")
+
+def load_negative_cache():
+    """Open the negative cache database and load its unexpired entries"""
+    global negative_cache_db
+    now = time.time()
+    try:
+        db = sqlite3.connect(NEGATIVE_CACHE_DB, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS negative_cache (path TEXT PRIMARY KEY, expires REAL NOT NULL)"
+        )
+        db.execute("DELETE FROM negative_cache WHERE expires <= ?", (now,))
+        rows = db.execute(
+            "SELECT path, expires FROM negative_cache ORDER BY expires DESC LIMIT ?",
+            (NEGATIVE_CACHE_MAX_ENTRIES,),
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"[NEGATIVE CACHE ERROR] {e} - failures will only be remembered in memory")
+        return 0
+    with negative_cache_lock:
+        # Soonest to expire first, so they are the first evicted
+        negative_cache.update(reversed(rows))
+        negative_cache_db = db
+    return len(rows)
+
+@lru_cache(maxsize=4096)
 def get_cache_path(path):
     """Generate cache file path for a URL path"""
-    safe_name = hashlib.md5(path.encode()).hexdigest()
-    return CACHE_DIR / f"{safe_name}.html"
+    safe_name = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+    return CACHE_DIR / f"{safe_name}.html.gz"
 
-def fetch_from_quibey(path):
-    """Fetch a page from quibey.com using Playwright to render JavaScript"""
-    quibey_url = f"https://quibey.com{path}"
+def get_meta_path(cache_path):
+    """Sidecar file holding the upstream URL and validators for a cache file"""
+    return cache_path.with_name(cache_path.name.split(".", 1)[0] + ".meta.json")
 
-    if not PLAYWRIGHT_AVAILABLE:
-        print(f"[QUIBEY] Playwright not available, skipping {path}")
-        return None, 500
+def start_fix_content_pool():
+    """Create the fix_content worker pool, replacing a broken one"""
+    global fix_content_executor
+    executor = ProcessPoolExecutor(
+        max_workers=FIX_CONTENT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    with fix_content_executor_lock:
+        old, fix_content_executor = fix_content_executor, executor
+    if old is not None:
+        old.shutdown(wait=False, cancel_futures=True)
 
+def run_fix_content(func, content, path):
+    """Run fix_content or fix_content_bytes in the worker pool, falling back to inline.
+
+    A worker that crashed leaves the pool permanently broken, so it is
+    replaced; a timeout only gives up on the worker for this page. A pool
+    replaced by another thread meanwhile refuses new work (RuntimeError) or
+    cancels what it had queued; those pages are fixed inline too.
+    """
+    executor = fix_content_executor
+    if executor is not None:
+        try:
+            return executor.submit(func, content, path, LOCAL_DOMAIN).result(timeout=FIX_CONTENT_TIMEOUT)
+        except BrokenProcessPool:
+            logger.error(f"[FIX CONTENT ERROR] {path}: worker pool broken, restarting it")
+            with fix_content_executor_lock:
+                broken = fix_content_executor is executor
+            if broken:
+                start_fix_content_pool()
+        except TimeoutError:
+            logger.error(f"[FIX CONTENT ERROR] {path}: no result after {FIX_CONTENT_TIMEOUT}s, fixing inline")
+        except (RuntimeError, CancelledError):
+            logger.error(f"[FIX CONTENT ERROR] {path}: worker pool was replaced, fixing inline")
+    return func(content, path, LOCAL_DOMAIN)
+
+def replace_file(target, data):
+    """Write data to target through a temp file in the same directory.
+
+    os.replace swaps the name atomically, so a reader that already has the
+    old file open keeps reading it whole, and a crash mid-write leaves only
+    a stray temp file rather than a truncated cache entry.
+    """
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".", suffix=".tmp")
     try:
-        print(f"[QUIBEY] Rendering {path} with Playwright...")
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            response = page.goto(
-                quibey_url,
-                wait_until=QUIBEY_WAIT_UNTIL,
-                timeout=QUIBEY_TIMEOUT_MS,
-            )
-
-            # Check if response is HTML
-            content_type = response.headers.get("content-type", "") if response else ""
-            if "text/html" not in content_type:
-                print(f"[QUIBEY] {path} -> not HTML ({content_type}), skipping")
-                browser.close()
-                return None, 404
-
-            # Wait for styled-components/emotion styles to render (best effort)
-            if QUIBEY_STYLE_WAIT_MS > 0:
-                try:
-                    page.wait_for_function(
-                        """() => {
-                            const hasStyled = Array.from(document.querySelectorAll('style[data-styled]'))
-                                .some(style => style.textContent && style.textContent.trim().length > 0);
-                            const hasEmotion = Array.from(document.querySelectorAll('style[data-emotion]'))
-                                .some(style => style.textContent && style.textContent.trim().length > 0);
-                            return hasStyled || hasEmotion;
-                        }""",
-                        timeout=QUIBEY_STYLE_WAIT_MS,
-                    )
-                except Exception:
-                    pass
-            page.wait_for_timeout(QUIBEY_POST_WAIT_MS)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def store_in_cache(path, cache_path, content, validators):
+    """Fix a fetched page, write it and its sidecar to disk, and return (body, etag, mtime)"""
+    # Fix content for local serving; Wayback bodies stay raw bytes
+    if isinstance(content, bytes):
+        content_bytes = run_fix_content(fix_content_bytes, content, path)
+    else:
+        content_bytes = run_fix_content(fix_content, content, path).encode('utf-8')
+
+    # zlib releases the GIL while compressing
+    compressed = gzip.compress(content_bytes, CACHE_COMPRESS_LEVEL)
+    meta = json.dumps(validators).encode('utf-8')
+    # Sidecar first: a body is never visible without its matching validators
+    replace_file(get_meta_path(cache_path), meta)
+    replace_file(cache_path, compressed)
+    disk_cache_added(len(compressed) + len(meta))
+    st = cache_path.stat()
+    entry = (compressed, file_etag(st), st.st_mtime)
+    memory_cache_put(path, *entry)
+    return entry
+
+def get_render_loop():
+    """Return the render event loop, starting its thread on first use"""
+    global render_loop, render_semaphore, _browser_lock
+    with render_loop_lock:
+        if render_loop is None:
+            loop = asyncio.new_event_loop()
+            # Created here so they belong to the render loop
+            render_semaphore = asyncio.Semaphore(max(RENDER_CONCURRENCY, 1))
+            _browser_lock = asyncio.Lock()
+            threading.Thread(target=loop.run_forever, name="playwright", daemon=True).start()
+            render_loop = loop
+        return render_loop
+
+async def close_browser(browser):
+    try:
+        await browser.close()
+    except Exception:
+        pass
+
+async def acquire_browser():
+    """Return the shared Chromium instance, relaunching it when due.
+
+    Every acquire must be paired with release_browser(). Only called on the
+    render loop, which owns all Playwright objects.
+    """
+    global _playwright, _browser, _browser_renders
+    async with _browser_lock:
+        if _browser is not None and (
+            _browser_renders >= BROWSER_RECYCLE_RENDERS or not _browser.is_connected()
+        ):
+            # Recycle periodically to cap Chromium's slow memory growth; renders
+            # still using the old browser finish first.
+            retired, _browser = _browser, None
+            if not _browser_users.get(retired):
+                _browser_users.pop(retired, None)
+                await close_browser(retired)
+        if _browser is None:
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+            _browser_renders = 0
+        _browser_renders += 1
+        _browser_users[_browser] = _browser_users.get(_browser, 0) + 1
+        return _browser
+
+async def release_browser(browser):
+    """Drop a render's hold on browser, closing it if it was retired meanwhile"""
+    _browser_users[browser] -= 1
+    if not _browser_users[browser]:
+        del _browser_users[browser]
+        if browser is not _browser:
+            await close_browser(browser)
+
+async def route_quibey_request(route):
+    """Abort requests that do not affect the rendered HTML"""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        part in request.url for part in BLOCKED_URL_PARTS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def render_quibey(path):
+    """Render one quibey.com page in a fresh context on the shared browser"""
+    quibey_url = f"https://quibey.com{path}"
+
+    async with render_semaphore:
+        browser = None
+        try:
+            logger.info(f"[QUIBEY] Rendering {path} with Playwright...")
+            browser = await acquire_browser()
+            context = await browser.new_context()
+            await context.route("**/*", route_quibey_request)
             try:
-                page.evaluate(
-                    """() => {
-                        const rules = [];
-                        for (const sheet of Array.from(document.styleSheets || [])) {
-                            const owner = sheet.ownerNode;
-                            if (!owner) continue;
-                            const isStyled = owner.hasAttribute && (
-                                owner.hasAttribute('data-styled') || owner.hasAttribute('data-emotion')
-                            );
-                            if (!isStyled) continue;
-                            try {
-                                for (const rule of Array.from(sheet.cssRules || [])) {
-                                    if (rule && rule.cssText) {
-                                        rules.push(rule.cssText);
-                                    }
-                                }
-                            } catch (err) {
-                                // Ignore cross-origin stylesheets.
-                            }
-                        }
-                        if (!rules.length) return;
-                        let tag = document.getElementById('inline-styles-from-cssom');
-                        if (!tag) {
-                            tag = document.createElement('style');
-                            tag.id = 'inline-styles-from-cssom';
-                            document.head.appendChild(tag);
-                        }
-                        tag.textContent = rules.join('\\n');
-                    }"""
+                page = await context.new_page()
+                response = await page.goto(
+                    quibey_url,
+                    wait_until=QUIBEY_WAIT_UNTIL,
+                    timeout=QUIBEY_TIMEOUT_MS,
                 )
-            except Exception:
-                pass
-            content = page.content()
-            browser.close()
+
+                # Check if response is HTML
+                content_type = response.headers.get("content-type", "") if response else ""
+                if "text/html" not in content_type:
+                    logger.info(f"[QUIBEY] {path} -> not HTML ({content_type}), skipping")
+                    return None, 404, None
+                validators = {
+                    "url": quibey_url,
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                }
+
+                # Style wait, CSSOM inlining and serialization in one round trip
+                content = await page.evaluate(
+                    QUIBEY_RENDER_JS,
+                    {"styleWaitMs": QUIBEY_STYLE_WAIT_MS, "postWaitMs": QUIBEY_POST_WAIT_MS},
+                )
+            finally:
+                await context.close()
 
             # Verify it's HTML content
             if len(content) > 1000 and (content.strip().startswith("<!") or content.strip().startswith("<html")):
-                print(f"[QUIBEY] {path} -> 200, {len(content)} bytes (rendered)")
-                return content, 200
-            return None, 404
+                logger.info(f"[QUIBEY] {path} -> 200, {len(content)} bytes (rendered)")
+                return content, 200, validators
+            return None, 404, None
+        except Exception as e:
+            logger.error(f"[QUIBEY ERROR] {path}: {e}")
+            return None, 500, None
+        finally:
+            if browser is not None:
+                await release_browser(browser)
+
+def stop_render_loop():
+    """Close every browser and Playwright itself, then stop the render loop"""
+    loop = render_loop
+    if loop is None:
+        return
+
+    async def close_all():
+        for browser in {*_browser_users, *([_browser] if _browser is not None else [])}:
+            await close_browser(browser)
+        if _playwright is not None:
+            await _playwright.stop()
+
+    try:
+        asyncio.run_coroutine_threadsafe(close_all(), loop).result(timeout=10)
     except Exception as e:
-        print(f"[QUIBEY ERROR] {path}: {e}")
-        return None, 500
+        logger.error(f"[QUIBEY ERROR] closing the browser: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+def fetch_from_quibey(path):
+    """Fetch a page from quibey.com using Playwright to render JavaScript"""
+    if not PLAYWRIGHT_AVAILABLE:
+        logger.info(f"[QUIBEY] Playwright not available, skipping {path}")
+        return None, 500, None
 
+    future = asyncio.run_coroutine_threadsafe(render_quibey(path), get_render_loop())
+    try:
+        return future.result(timeout=RENDER_TIMEOUT_SECONDS)
+    except TimeoutError:
+        future.cancel()  # Frees its render slot, or its place in the queue
+        logger.error(f"[QUIBEY ERROR] {path}: no render after {RENDER_TIMEOUT_SECONDS:.0f}s")
+        return None, 500, None
+
+def pooled_request(host, target, headers):
+    """GET target from host over a pooled keep-alive connection, returning (status, headers, body)"""
+    with connection_pools_lock:
+        idle = connection_pools.setdefault(host, [])
+        conn = idle.pop() if idle else None
+    reused = conn is not None
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=WAYBACK_TIMEOUT, context=SSL_CONTEXT)
+    try:
+        conn.request("GET", target, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+    except (http.client.HTTPException, OSError):
+        conn.close()
+        if reused:
+            # The server may have dropped an idle connection; retry on a fresh one.
+            return pooled_request(host, target, headers)
+        raise
+    if response.will_close:
+        conn.close()
+    else:
+        with connection_pools_lock:
+            if len(idle) < WAYBACK_POOL_SIZE:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+    return response.status, response.headers, body
+
+def pooled_get(url, headers):
+    """GET an absolute URL with pooled_request"""
+    parsed = urllib.parse.urlsplit(url)
+    target = parsed.path or "/"
+    if parsed.query:
+        target += "?" + parsed.query
+    return pooled_request(parsed.netloc, target, headers)
+
+def snapshot_key(path):
+    """Key for wayback_timestamps; a trailing slash doesn't change the page"""
+    return path.rstrip("/") or "/"
+
+def iter_cdx_rows(stream):
+    """Parse a CDX ``output=json`` body one row per line"""
+    header_seen = False
+    for raw_line in stream:
+        line = raw_line.strip().rstrip(b",")
+        # The outer array brackets sit on the first and last rows.
+        if line.startswith(b"[["):
+            line = line[1:]
+        if line.endswith(b"]]"):
+            line = line[:-1]
+        if line in (b"", b"[", b"]", b"[]"):
+            continue
+        if not header_seen:
+            header_seen = True
+            continue
+        yield json_loads(line)
+
+def resolve_wayback_timestamps():
+    """Map each archived path to its latest 200 snapshot at or before WAYBACK_TIMESTAMP"""
+    # No lower bound, so snapshots from earlier years count too. Collapsing
+    # on the day keeps one capture per path per day (collapse=urlkey would
+    # keep only the oldest), and rows are parsed as they stream in.
+    params = urllib.parse.urlencode({
+        "url": f"{ORIGINAL_DOMAIN}/*",
+        "output": "json",
+        "fl": "original,timestamp",
+        "filter": "statuscode:200",
+        "collapse": "timestamp:8",
+        "to": WAYBACK_TIMESTAMP,
+    })
+    cdx = urllib.parse.urlsplit(WAYBACK_CDX_URL)
+    conn = http.client.HTTPSConnection(cdx.netloc, timeout=WAYBACK_TIMEOUT, context=SSL_CONTEXT)
+    timestamps = {}
+    try:
+        conn.request("GET", f"{cdx.path}?{params}", headers={
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip",
+        })
+        response = conn.getresponse()
+        if response.status != 200:
+            logger.error(f"[CDX ERROR] status {response.status}")
+            return
+        stream = response
+        if response.getheader("Content-Encoding") == "gzip":
+            stream = gzip.GzipFile(fileobj=response)
+        for original, timestamp in iter_cdx_rows(stream):
+            key = snapshot_key(urllib.parse.urlsplit(original).path)
+            if timestamp > timestamps.get(key, ""):
+                timestamps[key] = timestamp
+    except Exception as e:
+        logger.error(f"[CDX ERROR] {e}")
+        return
+    finally:
+        conn.close()
+
+    wayback_timestamps.update(timestamps)
+    logger.info(f"[CDX] Resolved snapshots for {len(timestamps)} paths")
 
 def fetch_from_wayback(path):
     """Fetch a page from Wayback Machine (fallback)"""
-    wayback_url = f"https://web.archive.org/web/{WAYBACK_TIMESTAMP}id_/https://{ORIGINAL_DOMAIN}{path}"
-    ctx = get_ssl_context()
+    timestamp = wayback_timestamps.get(snapshot_key(path), WAYBACK_TIMESTAMP)
+    wayback_url = f"https://web.archive.org/web/{timestamp}id_/https://{ORIGINAL_DOMAIN}{path}"
+    headers = {"User-Agent": USER_AGENT}
 
     try:
-        req = urllib.request.Request(wayback_url, headers={
-            "User-Agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
-        })
-        with urllib.request.urlopen(req, context=ctx, timeout=45) as response:
-            content = response.read().decode('utf-8', errors='ignore')
-            print(f"[WAYBACK] {path} -> {response.status}, {len(content)} bytes")
-            return content, response.status
-    except urllib.error.HTTPError as e:
-        print(f"[HTTP ERROR] {path}: {e.code}")
-        return None, e.code
+        # Wayback redirects to the nearest snapshot, so follow redirects here
+        for _ in range(MAX_REDIRECTS):
+            status, response_headers, content = pooled_get(wayback_url, headers)
+            if status in (301, 302, 303, 307, 308) and response_headers.get("Location"):
+                wayback_url = urllib.parse.urljoin(wayback_url, response_headers["Location"])
+                continue
+            break
+        if status >= 300:
+            logger.error(f"[HTTP ERROR] {path}: {status}")
+            return None, status, {"retry_after": response_headers.get("Retry-After")}
+        logger.info(f"[WAYBACK] {path} -> {status}, {len(content)} bytes")
+        validators = {
+            "url": wayback_url,
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+        }
+        return content, status, validators
     except Exception as e:
-        print(f"[ERROR] {path}: {e}")
-        return None, 500
+        logger.error(f"[ERROR] {path}: {e}")
+        return None, 500, None
 
 
 def fetch_content(path):
-    """Try quibey.com first (with Playwright), then fall back to Wayback Machine"""
+    """Try quibey.com first (with Playwright), then fall back to Wayback Machine.
+
+    Returns (content, status, validators) where validators holds the upstream
+    URL, ETag and Last-Modified used to revalidate the cached copy later. For
+    an upstream error it may hold only the response's Retry-After instead.
+    """
     # Try quibey.com first (renders JavaScript for full content)
-    content, status = fetch_from_quibey(path)
+    content, status, validators = fetch_from_quibey(path)
     if content and status == 200:
-        return content, status
+        return content, status, validators
 
     # Fall back to Wayback Machine
     return fetch_from_wayback(path)
 
-class WaybackProxyHandler(http.server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        path = self.path.split('?')[0]  # Remove query string
-
-        # Serve SEO files (sitemap.xml, robots.txt)
-        if path in ['/sitemap.xml', '/robots.txt']:
-            seo_file = Path(path.lstrip('/'))
-            if seo_file.exists():
-                content = seo_file.read_text(encoding='utf-8')
-                content_type = 'application/xml' if path == '/sitemap.xml' else 'text/plain'
-                self.send_response(200)
-                self.send_header('Content-Type', content_type)
-                self.send_header('Content-Length', len(content.encode('utf-8')))
-                self.end_headers()
-                self.wfile.write(content.encode('utf-8'))
-                return
+def upstream_unchanged(validators):
+    """Ask upstream with a conditional GET whether a cached page is still current"""
+    headers = {"User-Agent": USER_AGENT}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    if len(headers) == 1:
+        return False  # Nothing to validate against
+    status, _, _ = pooled_get(validators["url"], headers)
+    return status == 304
 
-        # Serve static assets directly if they exist locally
-        local_file = Path("static_pages") / path.lstrip("/")
-        if local_file.is_dir():
-            index_file = local_file / "index.html"
-            if index_file.exists():
-                local_file = index_file
-        if local_file.exists() and local_file.is_file():
-            self.serve_local_file(local_file)
+def revalidate_cache(path, cache_path):
+    """Refresh a stale cached page, re-rendering only if upstream has changed"""
+    try:
+        try:
+            validators = json.loads(get_meta_path(cache_path).read_bytes())
+        except (OSError, ValueError):
+            validators = {}
+        if validators.get("url") and upstream_unchanged(validators):
+            # Touching the file restarts its TTL (and rolls its ETag)
+            os.utime(cache_path)
+            st = cache_path.stat()
+            entry = memory_cache_get(path)
+            if entry is not None:
+                memory_cache_put(path, entry[0], file_etag(st), st.st_mtime)
+            logger.info(f"[REVALIDATE] {path} -> unchanged")
             return
+        content, status, validators = fetch_content(path)
+        if content and status == 200:
+            store_in_cache(path, cache_path, content, validators)
+            logger.info(f"[REVALIDATE] {path} -> refreshed")
+        else:
+            logger.info(f"[REVALIDATE] {path} -> {status}, keeping stale copy")
+    except Exception as e:
+        logger.error(f"[REVALIDATE ERROR] {path}: {e}")
+    finally:
+        with inflight_lock:
+            revalidating.discard(path)
 
-        # Check cache first
-        cache_path = get_cache_path(path)
-        if cache_path.exists():
-            print(f"[CACHE] {path}")
-            content = cache_path.read_text(encoding='utf-8')
-            self.send_html_response(200, content)
+def schedule_revalidation(path, cache_path):
+    """Queue a background revalidation of path unless one is already pending"""
+    with inflight_lock:
+        if path in revalidating:
             return
+        revalidating.add(path)
+    REVALIDATE_EXECUTOR.submit(revalidate_cache, path, cache_path)
 
-        if not ALLOW_REMOTE_FETCH:
-            self.send_html_response(404, f"""
+# Header lines that never change, encoded once instead of per send_header() call
+SERVER_HEADER = (
+    f"Server: {http.server.BaseHTTPRequestHandler.server_version} "
+    f"{http.server.BaseHTTPRequestHandler.sys_version}\r\n"
+).encode("latin-1")
+HTML_HEADERS = (
+    b"Content-Type: text/html; charset=utf-8\r\n"
+    # SEO-friendly headers
+    b"X-Robots-Tag: index, follow\r\n"
+)
+CACHED_PAGE_HEADERS = HTML_HEADERS + (
+    f"Cache-Control: {DEFAULT_CACHE_CONTROL}\r\n"
+    "Vary: Accept-Encoding\r\n"
+).encode("latin-1")
+GZIP_HEADER = b"Content-Encoding: gzip\r\n"
+_date_header = (0, b"")
+
+def date_header():
+    """Date header line, formatted at most once per second"""
+    global _date_header
+    now = int(time.time())
+    if _date_header[0] != now:
+        _date_header = (now, f"Date: {email.utils.formatdate(now, usegmt=True)}\r\n".encode("latin-1"))
+    return _date_header[1]
+
+# Content types for files under static_pages, by lower-cased extension
+CONTENT_TYPES = MappingProxyType({
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.mjs': 'application/javascript',
+    '.json': 'application/json',
+    '.map': 'application/json',
+    '.xml': 'application/xml',
+    '.txt': 'text/plain',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mp3': 'audio/mpeg',
+    '.wasm': 'application/wasm',
+    '.pdf': 'application/pdf',
+})
+
+# Error pages, pre-encoded; %s is the requested path
+STATIC_ONLY_PAGE = b"""
 <!DOCTYPE html>
 <html>
 <head><title>Content Unavailable</title></head>
 <body>
 <h1>Content Unavailable</h1>
-<p>The page {path} is not available in static-only mode.</p>
+<p>The page %s is not available in static-only mode.</p>
 <p><a href="/">Go to homepage</a></p>
 </body>
-</html>""")
-            return
-
-        # Fetch from quibey.com first, then Wayback Machine
-        print(f"[FETCH] {path}")
-        content, status = fetch_content(path)
-
-        if content and status == 200:
-            # Fix content for local serving
-            content = fix_content(content, path, LOCAL_DOMAIN)
-
-            # Cache all content (even small SPA shells have SEO value)
-            cache_path.write_text(content, encoding='utf-8')
-
-            self.send_html_response(200, content)
-        elif status == 200 and not content:
-            # Empty response from Wayback
-            print(f"[EMPTY] {path}")
-            self.send_html_response(404, f"""
+</html>"""
+EMPTY_CONTENT_PAGE = b"""
 <!DOCTYPE html>
 <html>
 <head><title>Content Unavailable</title></head>
 <body>
 <h1>Content Unavailable</h1>
-<p>The archived content for {path} could not be retrieved.</p>
+<p>The archived content for %s could not be retrieved.</p>
 <p><a href="/">Go to homepage</a></p>
 </body>
-</html>""")
-        else:
-            # Try to serve a simple 404 page
-            print(f"[404] {path} - status: {status}")
-            self.send_html_response(404, f"""
+</html>"""
+NOT_FOUND_PAGE = b"""
 <!DOCTYPE html>
 <html>
 <head><title>Page Not Found</title></head>
 <body>
 <h1>404 - Page Not Found</h1>
-<p>The page {path} could not be found.</p>
+<p>The page %s could not be found.</p>
 <p><a href="/">Go to homepage</a></p>
 </body>
 </html>
-""")
+"""
+
+def parse_byte_range(range_header, size):
+    """Parse a single-range Range header into an inclusive (start, end).
+
+    Returns None when the whole file should be sent (no header, malformed, or
+    multiple ranges) and raises ValueError when the range is unsatisfiable.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    first, sep, last = range_header[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError(range_header)
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise ValueError(range_header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(','))
+
+class WaybackProxyHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive lets a page load reuse one connection for all of its assets
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Small responses go out in a single write; don't let Nagle hold them back
+    disable_nagle_algorithm = True
+
+    def close_if_saturated(self):
+        """Mark the connection to close after this response if the pool is full.
+
+        An idle keep-alive connection holds a pool thread, so once every
+        thread has a connection the response carries Connection: close and
+        the thread moves on to the next queued connection. Returns True if
+        the connection was marked here, so the caller sends the header.
+        """
+        if self.close_connection or not self.server.pool_saturated():
+            return False
+        self.close_connection = True
+        return True
+
+    def end_headers(self):
+        if self.close_if_saturated():
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def do_GET(self):
+        path = self.path.partition('?')[0]  # Remove query string
+
+        # Serve SEO files (sitemap.xml, robots.txt) straight from disk
+        if path in ('/sitemap.xml', '/robots.txt'):
+            try:
+                self.serve_local_file(path[1:])
+                return
+            except FileNotFoundError:
+                pass
+
+        # Cache hits are the common case, so check the cache before the
+        # filesystem: a memory hit needs no syscalls, a disk hit a single open()
+        cache_path = get_cache_path(path)
+        if self.serve_from_cache(path, cache_path):
+            return
+
+        # Serve static assets directly if they exist locally. The open() in
+        # serve_local_file is the only syscall on a miss: index.html is tried
+        # only when the path turned out to be a directory.
+        local_file = os.path.join(STATIC_ROOT, path.lstrip("/"))
+        try:
+            self.serve_local_file(local_file)
+            return
+        except IsADirectoryError:
+            try:
+                self.serve_local_file(os.path.join(local_file, "index.html"))
+                return
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                pass
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+        if not ALLOW_REMOTE_FETCH:
+            self.send_html_response(404, STATIC_ONLY_PAGE % path.encode('utf-8'))
+            return
+
+        if self.serve_negative_cached(path):
+            return
+
+        # Only one thread fetches a given cold path; the rest wait for its cache write
+        with inflight_lock:
+            done = inflight.get(path)
+            leader = done is None
+            if leader:
+                done = inflight[path] = threading.Event()
+        if not leader:
+            done.wait(INFLIGHT_WAIT_SECONDS)
+            if self.serve_from_cache(path, cache_path) or self.serve_negative_cached(path):
+                return
+        try:
+            self.fetch_and_serve(path, cache_path)
+        finally:
+            if leader:
+                with inflight_lock:
+                    del inflight[path]
+                done.set()
+
+    def fetch_and_serve(self, path, cache_path):
+        """Fetch a cold page, cache it and send it"""
+        # Fetch from quibey.com first, then Wayback Machine
+        logger.info(f"[FETCH] {path}")
+        content, status, validators = fetch_content(path)
+
+        if content and status == 200:
+            # Cache all content (even small SPA shells have SEO value)
+            self.send_cached_body(*store_in_cache(path, cache_path, content, validators))
+        elif status == 200 and not content:
+            # Empty response from Wayback
+            logger.info(f"[EMPTY] {path}")
+            negative_cache_put(path, 404)
+            self.send_html_response(404, EMPTY_CONTENT_PAGE % path.encode('utf-8'))
+        else:
+            # Try to serve a simple 404 page
+            logger.info(f"[404] {path} - status: {status}")
+            negative_cache_put(path, status, (validators or {}).get("retry_after"))
+            self.send_html_response(404, NOT_FOUND_PAGE % path.encode('utf-8'))
+
+    def serve_negative_cached(self, path):
+        """Send the 404 page for a path that recently failed to fetch; returns False otherwise"""
+        if not negative_cache_hit(path):
+            return False
+        logger.info(f"[404 CACHED] {path}")
+        self.send_html_response(404, NOT_FOUND_PAGE % path.encode('utf-8'))
+        return True
+
+    def serve_from_cache(self, path, cache_path):
+        """Serve path from memory or disk cache; returns False on a miss"""
+        entry = memory_cache_get(path)
+        if entry is not None:
+            logger.info(f"[CACHE] {path}")
+            self.send_cached_body(*entry)
+            mtime = entry[2]
+        else:
+            try:
+                mtime = self.serve_cache_file(path, cache_path)
+            except FileNotFoundError:
+                return False  # Not cached, or trimmed from disk since
+            logger.info(f"[CACHE] {path}")
+        # Stale pages are still served; a background refresh brings them up to date
+        if CACHE_TTL_SECONDS and time.time() - mtime > CACHE_TTL_SECONDS:
+            schedule_revalidation(path, cache_path)
+        return True
 
     def serve_local_file(self, filepath):
-        """Serve a local file"""
+        """Serve a local file, honouring single byte-range requests.
+
+        Opening the file is the existence check: FileNotFoundError,
+        IsADirectoryError and NotADirectoryError propagate before anything is sent.
+        """
+        with open(filepath, 'rb') as f:
+            try:
+                st = os.fstat(f.fileno())
+                etag = file_etag(st)
+                if FINGERPRINT_RE.search(os.path.basename(filepath)):
+                    cache_control = IMMUTABLE_CACHE_CONTROL
+                else:
+                    cache_control = DEFAULT_CACHE_CONTROL
+                if self.is_not_modified(etag, st.st_mtime):
+                    self.send_not_modified(etag, cache_control)
+                    self.end_headers()
+                    return
+
+                ext = os.path.splitext(filepath)[1].lower()
+                content_type = CONTENT_TYPES.get(ext, 'application/octet-stream')
+
+                size = st.st_size
+                status, start, length = 200, 0, size
+                headers = (
+                    f"Content-Type: {content_type}\r\n"
+                    f"ETag: {etag}\r\n"
+                    f"Last-Modified: {self.date_time_string(st.st_mtime)}\r\n"
+                    f"Cache-Control: {cache_control}\r\n"
+                    "Accept-Ranges: bytes\r\n"
+                )
+                if_range = self.headers.get('If-Range')
+                if not if_range or if_range == etag:
+                    try:
+                        byte_range = parse_byte_range(self.headers.get('Range'), size)
+                    except ValueError:
+                        headers += f"Content-Range: bytes */{size}\r\nContent-Length: 0\r\n"
+                        self.send_raw_response(416, headers.encode("latin-1"))
+                        return
+                    if byte_range is not None:
+                        start, end = byte_range
+                        status, length = 206, end - start + 1
+                        headers += f"Content-Range: bytes {start}-{end}/{size}\r\n"
+                headers += f"Content-Length: {length}\r\n"
+
+                if length < SENDFILE_MIN_BYTES:
+                    f.seek(start)
+                    self.send_raw_response(status, headers.encode("latin-1"), f.read(length))
+                else:
+                    self.send_raw_response(status, headers.encode("latin-1"))
+                    self.send_file_body(f, start, length)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # Client disconnected
+            except Exception as e:
+                self.send_error(500, str(e))
+
+    def serve_cache_file(self, path, cache_path):
+        """Serve a cached page from disk, keeping small pages in memory; returns its mtime"""
+        with open(cache_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            etag = file_etag(st)
+            if st.st_size <= MEMORY_CACHE_MAX_BYTES // 8:
+                body = f.read()
+                memory_cache_put(path, body, etag, st.st_mtime)
+                self.send_cached_body(body, etag, st.st_mtime)
+            elif not self.accepts_gzip():
+                self.send_cached_body(f.read(), etag, st.st_mtime)
+            else:
+                try:
+                    if self.send_cached_headers(st.st_size, etag, st.st_mtime, gzipped=True):
+                        self.send_file_body(f, 0, st.st_size)
+                except BrokenPipeError:
+                    self.close_connection = True  # Client disconnected
+        return st.st_mtime
+
+    def accepts_gzip(self):
+        """Whether the client can take a gzipped cache file as-is"""
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def send_cached_body(self, body, etag, mtime):
+        """Send a gzipped cached page, decompressing it only if the client needs that"""
         try:
-            content = filepath.read_bytes()
-            # Determine content type
-            ext = filepath.suffix.lower()
-            content_types = {
-                '.html': 'text/html',
-                '.css': 'text/css',
-                '.js': 'application/javascript',
-                '.json': 'application/json',
-                '.png': 'image/png',
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.gif': 'image/gif',
-                '.svg': 'image/svg+xml',
-                '.ico': 'image/x-icon',
-                '.webp': 'image/webp',
-            }
-            content_type = content_types.get(ext, 'application/octet-stream')
+            gzipped = self.accepts_gzip()
+            if not gzipped:
+                body = gzip.decompress(body)
+                etag = identity_etag(etag)
+            self.send_cached_headers(len(body), etag, mtime, gzipped, body)
+        except BrokenPipeError:
+            self.close_connection = True  # Client disconnected
 
-            self.send_response(200)
-            self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', len(content))
+    def send_cached_headers(self, size, etag, mtime, gzipped, body=b""):
+        """Send headers for a cached page, plus body if given; returns False if a 304 was sent instead"""
+        if self.is_not_modified(etag, mtime):
+            self.send_not_modified(etag, DEFAULT_CACHE_CONTROL)
+            self.send_header('Vary', 'Accept-Encoding')
             self.end_headers()
-            self.wfile.write(content)
-        except BrokenPipeError:
-            pass  # Client disconnected
-        except Exception as e:
-            self.send_error(500, str(e))
+            return False
+        headers = (
+            f"Content-Length: {size}\r\n"
+            f"ETag: {etag}\r\n"
+            f"Last-Modified: {self.date_time_string(mtime)}\r\n"
+        ).encode("latin-1")
+        if gzipped:
+            headers = GZIP_HEADER + headers
+        self.send_raw_response(200, CACHED_PAGE_HEADERS + headers, body)
+        return True
+
+    def is_not_modified(self, etag, mtime):
+        """Check the request's conditional headers against a resource's validators"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            # If-None-Match takes precedence over If-Modified-Since
+            return etag_matches(if_none_match, etag)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if not if_modified_since:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+
+    def send_not_modified(self, etag, cache_control):
+        """Start a 304 response; the caller may add headers before end_headers()"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
 
     def send_html_response(self, status, content):
-        """Send an HTML response"""
+        """Send an HTML response from str or already-encoded bytes"""
         try:
-            content_bytes = content.encode('utf-8')
-            self.send_response(status)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.send_header('Content-Length', len(content_bytes))
-            # SEO-friendly headers
-            self.send_header('X-Robots-Tag', 'index, follow')
-            self.end_headers()
-            self.wfile.write(content_bytes)
+            content_bytes = content if isinstance(content, bytes) else content.encode('utf-8')
+            headers = HTML_HEADERS + f"Content-Length: {len(content_bytes)}\r\n".encode("latin-1")
+            self.send_raw_response(status, headers, content_bytes)
         except BrokenPipeError:
-            pass  # Client disconnected, ignore
+            self.close_connection = True  # Client disconnected
+
+    def send_file_body(self, f, offset, count):
+        """Stream count bytes of an open file to the client without copying them through Python.
+
+        socket.sendfile uses os.sendfile where available, else a send() loop. The
+        headers have already gone out, so a failure part-way can't become a 500;
+        the connection is dropped instead so the client sees a short response.
+        """
+        try:
+            self.connection.sendfile(f, offset, count)
+        except OSError:
+            self.close_connection = True
+
+    def send_raw_response(self, status, headers, body=b""):
+        """Write the status line, pre-encoded header lines and body in one write.
+
+        Bypasses send_header(), which formats and buffers every line separately.
+        """
+        self.log_request(status)
+        self.wfile.write(b"".join((
+            f"{self.protocol_version} {status} {self.responses[status][0]}\r\n".encode("latin-1"),
+            SERVER_HEADER,
+            date_header(),
+            b"Connection: close\r\n" if self.close_if_saturated() else b"",
+            headers,
+            b"\r\n",
+            body,
+        )))
 
     def log_message(self, format, *args):
         """Custom log format"""
-        print(f"[{self.log_date_time_string()}] {args[0]}")
+        logger.info(f"[{self.log_date_time_string()}] {args[0]}")
+
 
+class ThreadedHTTPServer(http.server.HTTPServer):
+    """Handle requests on a fixed pool of worker threads.
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    """Handle requests in separate threads for better concurrency"""
-    daemon_threads = True
+    ThreadingMixIn starts a new OS thread per connection, which under a crawl
+    burst means hundreds of threads contending for the GIL; a pool reuses
+    threads and queues connections past SERVER_WORKERS instead.
+    """
+    request_queue_size = 128
 
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=SERVER_WORKERS, thread_name_prefix="http")
+        # Connections being handled or queued for a worker
+        self.connections = 0
+        self.connections_lock = threading.Lock()
+
+    def pool_saturated(self):
+        """Whether every worker thread already has a connection"""
+        return self.connections >= SERVER_WORKERS
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections += 1
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fork_server_processes(count):
+    """Fork count - 1 more processes to accept on the already bound socket.
+
+    Returns the child pids in the parent and an empty list in each child.
+    Call before any thread is started: threads do not survive a fork. Every
+    process keeps its own memory cache, browser, connection pools and
+    fix_content workers; the disk cache and negative cache database are shared.
+    """
+    children = []
+    for _ in range(count - 1):
+        pid = os.fork()
+        if pid == 0:
+            return []
+        children.append(pid)
+    return children
 
 def run_server():
     """Run the proxy server"""
     server_address = ('', PORT)
     httpd = ThreadedHTTPServer(server_address, WaybackProxyHandler)
+    processes = SERVER_PROCESSES if hasattr(os, "fork") else 1
 
     print("=" * 60)
     print(f"Wayback Proxy Server for hero.page")
     print("=" * 60)
     print(f"Server running at http://localhost:{PORT}")
+    print(f"Server processes: {processes} x {SERVER_WORKERS} threads")
     print(f"Proxying content from Wayback Machine")
+    if not PLAYWRIGHT_AVAILABLE:
+        print("[WARNING] Playwright not available - pages will not render JavaScript")
     print(f"Remote fetch: {'enabled' if ALLOW_REMOTE_FETCH else 'disabled (static-only)'}")
     print(f"Cache directory: {CACHE_DIR.absolute()}")
     print()
     print("For production, change LOCAL_DOMAIN to your actual domain")
     print("Press Ctrl+C to stop")
     print("=" * 60)
+    sys.stdout.flush()  # Or forked children would repeat buffered output
+
+    children = fork_server_processes(processes)
+    # Every process exits through the finally below on SIGTERM, so its
+    # worker pool and browser are shut down rather than orphaned
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    log_listener.start()
+    if ALLOW_REMOTE_FETCH:
+        start_fix_content_pool()
+    disk_cache_added(sum(size for _, size, _ in scan_disk_cache()))
+    if ALLOW_REMOTE_FETCH:
+        logger.info(f"Negative cache: {load_negative_cache()} paths from {NEGATIVE_CACHE_DB}")
+        threading.Thread(target=resolve_wayback_timestamps, daemon=True).start()
 
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\nShutting down...")
-        httpd.shutdown()
+        if children or processes == 1:
+            print("\nShutting down...")
+    finally:
+        # A second SIGTERM must not cut the cleanup short
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        httpd.server_close()
+        if fix_content_executor is not None:
+            fix_content_executor.shutdown(wait=True, cancel_futures=True)
+        stop_render_loop()
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        # Last, so records logged during shutdown are flushed too
+        log_listener.stop()
 
 if __name__ == "__main__":
     run_server()
@@ -3,9 +3,9 @@
 Render Quibey pages for hero.page URLs listed in a CSV and save to static_pages.
 """
 import argparse
+import asyncio
 import csv
 import os
-import time
 import tempfile
 from pathlib import Path
 from urllib.parse import urlparse
@@ -13,7 +13,7 @@ from urllib.parse import urlparse
 from content_utils import fix_content
 
 try:
-    from playwright.sync_api import sync_playwright
+    from playwright.async_api import async_playwright
 except ImportError as exc:
     raise SystemExit(
         "Playwright is required. Install it with: pip install playwright && playwright install chromium"
@@ -112,6 +112,12 @@ def parse_args():
         default=0.2,
         help="Delay between requests (seconds)",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.environ.get("QUIBEY_CONCURRENCY", "6")),
+        help="Number of pages rendered at once in the shared browser",
+    )
     parser.add_argument(
         "--force",
         action="store_true",
@@ -150,13 +156,15 @@ def normalize_path(raw_path):
 
 
 def output_path_for(base_dir, path):
-    if path in ("", "/"):
+    cleaned = path.strip("/")
+    if not cleaned:
         return base_dir / "index.html"
-    cleaned = path.lstrip("/").rstrip("/")
-    suffix = Path(cleaned).suffix.lower()
-    if suffix and suffix in KNOWN_FILE_EXTENSIONS:
+    # Same rule as Path.suffix, without building a Path just to read it
+    name = cleaned.rpartition("/")[2]
+    dot = name.rfind(".")
+    if 0 < dot < len(name) - 1 and name[dot:].lower() in KNOWN_FILE_EXTENSIONS:
         return base_dir / cleaned
-    return base_dir / cleaned / "index.html"
+    return base_dir / f"{cleaned}/index.html"
 
 
 def ensure_output_parent(output_path, base_dir):
@@ -207,11 +215,11 @@ def chromium_launch_args():
     ]
 
 
-def wait_for_rendered_styles(page, timeout_ms):
+async def wait_for_rendered_styles(page, timeout_ms):
     if timeout_ms <= 0:
         return
     try:
-        page.wait_for_function(
+        await page.wait_for_function(
             """() => {
                 const hasStyled = Array.from(document.querySelectorAll('style[data-styled]'))
                     .some(style => style.textContent && style.textContent.trim().length > 0);
@@ -225,9 +233,9 @@ def wait_for_rendered_styles(page, timeout_ms):
         pass
 
 
-def inline_cssom_styles(page):
+async def inline_cssom_styles(page):
     try:
-        page.evaluate(
+        await page.evaluate(
             """() => {
                 const rules = [];
                 for (const sheet of Array.from(document.styleSheets || [])) {
@@ -275,31 +283,43 @@ def has_inline_css(output_path):
     return False
 
 
-def create_browser_session(p):
+async def create_browser_session(p):
     chromium_exec = resolve_chromium_executable(p)
     if chromium_exec is None:
         raise SystemExit(
             "Chromium executable not found. Run: python -m playwright install chromium"
         )
-    browser = p.chromium.launch(
+    browser = await p.chromium.launch(
         headless=True,
         executable_path=str(chromium_exec),
         args=chromium_launch_args(),
     )
-    context = browser.new_context()
-    page = context.new_page()
-    return browser, context, page
+    context = await browser.new_context()
+    return browser, context
 
 
 def load_paths(csv_path, host_prefixes):
     paths = []
     skipped_hosts = {}
     seen = set()
+    add_seen = seen.add
+    add_path = paths.append
 
     with open(csv_path, newline="", encoding="utf-8") as handle:
-        reader = csv.DictReader(handle)
+        # Plain rows with the URL column looked up once from the header,
+        # rather than a dict per row and a key fallback chain.
+        reader = csv.reader(handle)
+        header = next(reader, [])
+        url_idx = next(
+            (i for i, name in enumerate(header) if name.strip().lower() == "url"),
+            None,
+        )
+        if url_idx is None:
+            return paths, skipped_hosts
         for row in reader:
-            url = row.get("URL") or row.get("Url") or row.get("url")
+            if len(row) <= url_idx:
+                continue
+            url = row[url_idx]
             if not url:
                 continue
             url = url.strip()
@@ -316,13 +336,13 @@ def load_paths(csv_path, host_prefixes):
                 path = normalize_path(f"{prefix}/{path.lstrip('/')}")
 
             if path not in seen:
-                seen.add(path)
-                paths.append(path)
+                add_seen(path)
+                add_path(path)
 
     return paths, skipped_hosts
 
 
-def render_pages(
+async def render_pages(
     paths,
     output_dir,
     domain,
@@ -333,81 +353,106 @@ def render_pages(
     timeout_ms,
     render_wait_ms,
     style_wait_ms,
+    concurrency,
 ):
     output_dir.mkdir(parents=True, exist_ok=True)
 
     total = len(paths)
-    rendered = 0
-    skipped = 0
-    failed = 0
-
-    with sync_playwright() as p:
-        browser, context, page = create_browser_session(p)
-
-        for idx, path in enumerate(paths, 1):
+    stats = {"rendered": 0, "skipped": 0, "failed": 0}
+
+    async with async_playwright() as p:
+        # Every page shares one browser context. A crashed browser is
+        # relaunched once per generation, however many pages notice it.
+        session = {"generation": 0}
+        session["browser"], session["context"] = await create_browser_session(p)
+        session_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def restart_session(generation):
+            async with session_lock:
+                if session["generation"] != generation:
+                    return
+                try:
+                    await session["context"].close()
+                    await session["browser"].close()
+                except Exception:
+                    pass
+                session["browser"], session["context"] = await create_browser_session(p)
+                session["generation"] += 1
+
+        async def render_one(idx, path):
             target_url = f"https://quibey.com{path}"
             output_path = output_path_for(output_dir, path)
 
             if output_path.exists() and not force:
                 if has_inline_css(output_path):
-                    skipped += 1
-                    continue
+                    stats["skipped"] += 1
+                    return
 
-            response = None
             for attempt in range(2):
+                generation = session["generation"]
+                page = None
                 try:
-                    response = page.goto(
+                    page = await session["context"].new_page()
+                    response = await page.goto(
                         target_url,
                         wait_until=wait_until,
                         timeout=timeout_ms,
                     )
+
+                    status = response.status if response else None
+                    content_type = response.headers.get("content-type", "") if response else ""
+                    if not response or "text/html" not in content_type:
+                        stats["failed"] += 1
+                        print(
+                            f"[{idx}/{total}] SKIP {path} -> status={status} content-type={content_type}"
+                        )
+                        return
+
+                    await wait_for_rendered_styles(page, style_wait_ms)
+                    await page.wait_for_timeout(render_wait_ms)
+                    await inline_cssom_styles(page)
+                    content = await page.content()
                     break
                 except Exception as exc:
                     if attempt == 0 and "TargetClosed" in str(exc):
+                        await restart_session(generation)
+                        continue
+                    stats["failed"] += 1
+                    print(f"[{idx}/{total}] ERROR {path}: {exc}")
+                    return
+                finally:
+                    if page is not None:
                         try:
-                            context.close()
-                            browser.close()
+                            await page.close()
                         except Exception:
                             pass
-                        browser, context, page = create_browser_session(p)
-                        continue
-                    failed += 1
-                    print(f"[{idx}/{total}] ERROR {path}: {exc}")
-                    response = None
-                    break
-            if response is None:
-                continue
-
-            status = response.status if response else None
-            content_type = response.headers.get("content-type", "") if response else ""
-            if not response or "text/html" not in content_type:
-                failed += 1
-                print(
-                    f"[{idx}/{total}] SKIP {path} -> status={status} content-type={content_type}"
-                )
-                continue
 
-            wait_for_rendered_styles(page, style_wait_ms)
-            page.wait_for_timeout(render_wait_ms)
-            inline_cssom_styles(page)
-            content = page.content()
             if len(content) < min_bytes:
-                failed += 1
+                stats["failed"] += 1
                 print(f"[{idx}/{total}] SKIP {path} -> {len(content)} bytes")
-                continue
+                return
 
             fixed = fix_content(content, path, domain)
             ensure_output_parent(output_path, output_dir)
             output_path.write_text(fixed, encoding="utf-8")
-            rendered += 1
+            stats["rendered"] += 1
             print(f"[{idx}/{total}] OK {path} -> {output_path}")
 
             if sleep_delay:
-                time.sleep(sleep_delay)
+                await asyncio.sleep(sleep_delay)
+
+        async def bounded(idx, path):
+            async with semaphore:
+                await render_one(idx, path)
 
-        browser.close()
+        await asyncio.gather(
+            *(bounded(idx, path) for idx, path in enumerate(paths, 1))
+        )
+
+        await session["browser"].close()
 
-    return rendered, skipped, failed
+    return stats["rendered"], stats["skipped"], stats["failed"]
 
 
 def main():
@@ -430,17 +475,20 @@ def main():
             print(f"  {host}: {count}")
 
     output_dir = Path(args.output_dir)
-    rendered, skipped, failed = render_pages(
-        paths,
-        output_dir,
-        args.domain,
-        args.min_bytes,
-        args.sleep,
-        args.force,
-        args.wait_until,
-        args.timeout_ms,
-        args.render_wait_ms,
-        args.style_wait_ms,
+    rendered, skipped, failed = asyncio.run(
+        render_pages(
+            paths,
+            output_dir,
+            args.domain,
+            args.min_bytes,
+            args.sleep,
+            args.force,
+            args.wait_until,
+            args.timeout_ms,
+            args.render_wait_ms,
+            args.style_wait_ms,
+            args.concurrency,
+        )
     )
 
     print("-" * 60)
@@ -3,14 +3,25 @@
 Download referenced /static assets for pages in static_pages.
 """
 import argparse
+import email.utils
+import gzip
+import http.client
+import os
 import re
+import shutil
+import threading
 import time
+import urllib.error
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import repeat
 from pathlib import Path
 
 DEFAULT_OUTPUT_DIR = "static_pages"
 DEFAULT_BASE_URL = "https://quibey.com"
+DEFAULT_WORKERS = 16
+MAX_REDIRECTS = 5
+TIMEOUT = 60
 
 DEFAULT_STATIC_FILES = {
     "/android-chrome-192x192.png",
@@ -25,6 +36,12 @@ DEFAULT_STATIC_FILES = {
     "/logo512.png",
 }
 
+HTML_ASSET_RE = re.compile(r'(?:href|src)=["\']([^"\']+)["\']')
+CSS_URL_RE = re.compile(r"url\(([^)]+)\)")
+
+# Keep-alive connections, one set per worker thread
+connections = threading.local()
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -46,6 +63,12 @@ def parse_args():
         default=0.1,
         help="Delay between downloads (seconds)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of assets downloaded at once",
+    )
     parser.add_argument(
         "--force",
         action="store_true",
@@ -76,7 +99,7 @@ def should_download(path):
 
 def extract_from_html(content):
     assets = set()
-    for match in re.findall(r'(?:href|src)=["\']([^"\']+)["\']', content):
+    for match in HTML_ASSET_RE.findall(content):
         path = normalize_asset_path(match)
         if path and should_download(path):
             assets.add(path)
@@ -85,7 +108,7 @@ def extract_from_html(content):
 
 def extract_from_css(content):
     assets = set()
-    for match in re.findall(r"url\\(([^)]+)\\)", content):
+    for match in CSS_URL_RE.findall(content):
         value = match.strip().strip("'\"")
         path = normalize_asset_path(value)
         if path and should_download(path):
@@ -93,42 +116,142 @@ def extract_from_css(content):
     return assets
 
 
+def scan_file(path, extract):
+    try:
+        content = path.read_text(encoding="utf-8", errors="ignore")
+    except Exception:
+        return set()
+    return extract(content)
+
+
 def collect_assets(output_dir):
     assets = set(DEFAULT_STATIC_FILES)
 
-    for html_file in output_dir.rglob("*.html"):
-        try:
-            content = html_file.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            continue
-        assets.update(extract_from_html(content))
-
-    css_dir = output_dir / "static" / "css"
-    if css_dir.exists():
-        for css_file in css_dir.rglob("*.css"):
-            try:
-                content = css_file.read_text(encoding="utf-8", errors="ignore")
-            except Exception:
-                continue
-            assets.update(extract_from_css(content))
+    # Reading is most of the work, so files are scanned on a thread pool
+    # to overlap their disk reads.
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as executor:
+        for found in executor.map(
+            scan_file, output_dir.rglob("*.html"), repeat(extract_from_html)
+        ):
+            assets.update(found)
+
+        css_dir = output_dir / "static" / "css"
+        if css_dir.exists():
+            for found in executor.map(
+                scan_file, css_dir.rglob("*.css"), repeat(extract_from_css)
+            ):
+                assets.update(found)
 
     return sorted(assets)
 
 
+def get_connection(scheme, host):
+    pool = getattr(connections, "pool", None)
+    if pool is None:
+        pool = connections.pool = {}
+    conn = pool.get((scheme, host))
+    if conn is None:
+        if scheme == "http":
+            conn = http.client.HTTPConnection(host, timeout=TIMEOUT)
+        else:
+            conn = http.client.HTTPSConnection(host, timeout=TIMEOUT)
+        pool[(scheme, host)] = conn
+    return conn
+
+
+def send_request(conn, target, headers):
+    """GET target on a keep-alive connection and return the response.
+
+    A reused connection may have been dropped by the server while idle, so
+    a failure before any response arrives is retried once on a fresh socket.
+    """
+    reused = conn.sock is not None
+    try:
+        conn.request("GET", target, headers=headers)
+        return conn.getresponse()
+    except (http.client.HTTPException, OSError):
+        conn.close()
+        if not reused:
+            raise
+    # close() left it unconnected, so this request opens a new socket
+    conn.request("GET", target, headers=headers)
+    return conn.getresponse()
+
+
 def download_asset(base_url, output_dir, path, force=False):
     url = base_url.rstrip("/") + path
     target = output_dir / path.lstrip("/")
-    if target.exists() and target.stat().st_size > 0 and not force:
-        return "skip"
+    headers = {"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip"}
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_size > 0:
+        if not force:
+            return "skip"
+        # Forced refreshes still let the origin answer 304 for unchanged files
+        headers["If-Modified-Since"] = email.utils.formatdate(st.st_mtime, usegmt=True)
 
     target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".part")
+
+    for _ in range(MAX_REDIRECTS):
+        parsed = urllib.parse.urlsplit(url)
+        request_target = parsed.path or "/"
+        if parsed.query:
+            request_target += "?" + parsed.query
+        conn = get_connection(parsed.scheme, parsed.netloc)
+        try:
+            response = send_request(conn, request_target, headers)
+            if response.status >= 300:
+                # Drain the body so the connection can be reused.
+                response.read()
+            else:
+                # Stream to a side file so a failed transfer never leaves a
+                # truncated asset that a later run would skip.
+                body = response
+                if response.getheader("Content-Encoding", "").lower() == "gzip":
+                    body = gzip.GzipFile(fileobj=response)
+                with open(partial, "wb") as handle:
+                    shutil.copyfileobj(body, handle, 65536)
+        except (http.client.HTTPException, OSError, EOFError):
+            # Drop the broken socket; the next request reconnects.
+            conn.close()
+            partial.unlink(missing_ok=True)
+            raise
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            continue
+        if response.status == 304:
+            return "skip"
+        if response.status >= 300:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        try:
+            partial.replace(target)
+        except OSError:
+            partial.unlink(missing_ok=True)
+            raise
+        # Date the file as the origin does, for the next If-Modified-Since
+        last_modified = response.getheader("Last-Modified")
+        if last_modified:
+            try:
+                mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                os.utime(target, (mtime, mtime))
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return "ok"
+
+    raise urllib.error.URLError(f"too many redirects for {url}")
 
-    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-    with urllib.request.urlopen(req, timeout=60) as response:
-        content = response.read()
-        target.write_bytes(content)
 
-    return "ok"
+def fetch_asset(base_url, output_dir, path, force, sleep_delay):
+    try:
+        result = download_asset(base_url, output_dir, path, force=force)
+    except Exception as exc:
+        return "fail", exc
+    if result == "ok" and sleep_delay:
+        time.sleep(sleep_delay)
+    return result, None
 
 
 def main():
@@ -147,22 +270,24 @@ def main():
     skipped = 0
     failed = 0
 
-    for idx, path in enumerate(assets, 1):
-        try:
-            result = download_asset(args.base_url, output_dir, path, force=args.force)
-        except Exception as exc:
-            failed += 1
-            print(f"[{idx}/{len(assets)}] FAIL {path}: {exc}")
-            continue
-
-        if result == "ok":
-            downloaded += 1
-            print(f"[{idx}/{len(assets)}] OK {path}")
-        else:
-            skipped += 1
-
-        if args.sleep:
-            time.sleep(args.sleep)
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = {
+            executor.submit(
+                fetch_asset, args.base_url, output_dir, path, args.force, args.sleep
+            ): path
+            for path in assets
+        }
+        for idx, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            result, exc = future.result()
+            if result == "fail":
+                failed += 1
+                print(f"[{idx}/{len(assets)}] FAIL {path}: {exc}")
+            elif result == "ok":
+                downloaded += 1
+                print(f"[{idx}/{len(assets)}] OK {path}")
+            else:
+                skipped += 1
 
     print("-" * 60)
     print(f"Downloaded: {downloaded}")